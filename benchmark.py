@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from shapely import get_coordinates
+from shapely.geometry import mapping
+
+from config import GEOJSON_PRECISION, GEOJSON_QUALITIES, VERSION
+from geojson_writer import write_geojson
+from instrument import _peak_rss
+from osm_countries_gen import OSMCountry, _assemble_geometry, _polygonal, _simplify
+from synthetic import split_rings, synthetic_countries
+from topojson_writer import write_topojson
+from toposimplify import Topology
+
+
+class _Recorder:
+    __slots__ = ('_memory', 'results')
+
+    def __init__(self, *, memory: bool):
+        self._memory = memory
+        self.results: dict[str, dict[str, Any]] = {}
+
+    def run[T](self, name: str, func: Callable[[], T], items: Callable[[T], int]) -> T:
+        stage = self.results.setdefault(name, {'times': []})
+        if self._memory:
+            stage['peak_memory'] = _fork_peak_rss(func)
+        ts = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - ts
+        stage['times'].append(elapsed)
+        stage['items'] = items(result)
+        return result
+
+
+def _fork_peak_rss(func: Callable[[], object]) -> int:
+    # run the stage in a forked child and report how much it raised the peak RSS:
+    # unlike tracemalloc this covers GEOS and numpy allocations, and the child's ru_maxrss
+    # starts from the current RSS instead of the peak of the earlier stages
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        exit_code = 1
+        try:
+            os.close(read_fd)
+            baseline = _peak_rss(resource.RUSAGE_SELF)
+            func()
+            os.write(write_fd, str(_peak_rss(resource.RUSAGE_SELF) - baseline).encode())
+            exit_code = 0
+        finally:
+            os._exit(exit_code)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    _, status = os.waitpid(pid, 0)
+    if exit_code := os.waitstatus_to_exitcode(status):
+        raise RuntimeError(f'Memory measurement failed with exit code {exit_code}')
+    return int(output)
+
+
+def _run_pipeline(recorder: _Recorder, args: argparse.Namespace, output_dir: Path) -> None:
+    geoms = recorder.run(
+        'fixture',
+        lambda: synthetic_countries(
+            args.countries,
+            density=args.density,
+            seed=args.seed,
+            enclaves=args.enclaves,
+            holes=args.holes,
+            islands=args.islands,
+        ),
+        lambda geoms: int(sum(len(get_coordinates(geom)) for geom in geoms)),
+    )
+    segments = [split_rings(geom, args.way_size) for geom in geoms]
+    geoms = recorder.run(
+        'assemble',
+        lambda: _polygonal([_assemble_geometry(outer, inner) for outer, inner in segments]),
+        lambda _: sum(len(outer) + len(inner) for outer, inner in segments),
+    )
+    topo = recorder.run('topology', lambda: Topology(geoms), lambda _: len(geoms))
+    simplified = recorder.run(
+        'simplify',
+        lambda: {q: _simplify(topo, q)[0] for q in GEOJSON_QUALITIES},
+        lambda result: sum(len(get_coordinates(geom)) for geoms in result.values() for geom in geoms),
+    )
+
+    countries = [
+        OSMCountry(
+            tags={'name': f'Country {i}', 'ISO3166-1': f'{chr(65 + i // 26 % 26)}{chr(65 + i % 26)}'},
+            geometry={q: simplified[q][i] for q in GEOJSON_QUALITIES},
+            representative_point=mapping(geom.representative_point()),
+        )
+        for i, geom in enumerate(geoms)
+    ]
+
+    def write_all(suffix: str, write: Callable[[Path, float], None]) -> int:
+        size = 0
+        for q in GEOJSON_QUALITIES:
+            path = output_dir / f'{q}{suffix}'
+            write(path, q)
+            size += path.stat().st_size
+        return size
+
+    recorder.run(
+        'write_geojson',
+        lambda: write_all(
+            '.geojson',
+            lambda path, q: write_geojson(path, countries, q, 0.0, precision=GEOJSON_PRECISION.get(q)),
+        ),
+        lambda size: size,
+    )
+    recorder.run(
+        'write_topojson',
+        lambda: write_all(
+            '.topojson',
+            lambda path, q: write_topojson(
+                path, countries, topo.simplify_arcs(q), 0.0, precision=GEOJSON_PRECISION.get(q)
+            ),
+        ),
+        lambda size: size,
+    )
+
+
+def _benchmark(args: argparse.Namespace) -> None:
+    recorder = _Recorder(memory=False)
+    with TemporaryDirectory() as tmp:
+        for _ in range(args.repeat):
+            _run_pipeline(recorder, args, Path(tmp))
+
+        # memory is measured in a separate run, each stage runs twice there
+        if not args.no_memory:
+            memory_recorder = _Recorder(memory=True)
+            _run_pipeline(memory_recorder, args, Path(tmp))
+            for name, stage in memory_recorder.results.items():
+                recorder.results[name]['peak_memory'] = stage['peak_memory']
+
+    for stage in recorder.results.values():
+        stage['time'] = min(stage['times'])
+
+    result = {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'params': {
+            key: getattr(args, key)
+            for key in ('countries', 'density', 'seed', 'enclaves', 'holes', 'islands', 'way_size', 'repeat')
+        },
+        'stages': recorder.results,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output + '\n')
+        for name, stage in recorder.results.items():
+            memory = f'{stage["peak_memory"] / 1024 / 1024:.1f} MiB' if 'peak_memory' in stage else '-'
+            print(f'{name:16} {stage["time"]:9.3f}s {memory:>12} {stage["items"]:>12}')
+
+
+def _compare(args: argparse.Namespace) -> int:
+    # exit with an error when any stage got slower than the threshold
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    if old['params'] != new['params']:
+        print(f'⚠️ Parameters differ: {old["params"]} != {new["params"]}')
+
+    regressions = 0
+    print(f'{"stage":16} {old["version"]:>12} {new["version"]:>12} {"change":>9}')
+    for name, new_stage in new['stages'].items():
+        old_stage = old['stages'].get(name)
+        if old_stage is None:
+            continue
+        change = new_stage['time'] / old_stage['time'] - 1 if old_stage['time'] else 0
+        line = f'{name:16} {old_stage["time"]:11.3f}s {new_stage["time"]:11.3f}s {change:+9.1%}'
+        if 'peak_memory' in old_stage and 'peak_memory' in new_stage and old_stage['peak_memory']:
+            line += f' {new_stage["peak_memory"] / old_stage["peak_memory"] - 1:+9.1%} memory'
+        if change > args.threshold:
+            regressions += 1
+            line += ' ⚠️'
+        print(line)
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the geometry pipeline on synthetic countries')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--countries', type=int, default=200)
+    run_parser.add_argument('--density', type=float, default=200, help='border vertices per degree')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--enclaves', type=int, default=10)
+    run_parser.add_argument('--holes', type=int, default=10)
+    run_parser.add_argument('--islands', type=int, default=20)
+    run_parser.add_argument('--way-size', type=int, default=100, help='points per synthetic way')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--no-memory', action='store_true', help='skip the peak RSS run')
+    run_parser.add_argument('--output', type=Path, help='JSON results path, printed to stdout by default')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('old', type=Path)
+    compare_parser.add_argument('new', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown ratio')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        return _compare(args)
+    _benchmark(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
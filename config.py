@@ -9,11 +9,33 @@ WEBSITE = 'https://github.com/Zaczero/osm-countries-geojson'
 USER_AGENT = f'{NAME}/{VERSION} (+{WEBSITE})'
 
 OVERPASS_API_INTERPRETER = os.getenv('OVERPASS_API_INTERPRETER', 'https://overpass-api.de/api/interpreter')
+
+# split the countries query into shards by ISO3166-1 code ranges (up to 26), fetched concurrently, 0 disables
+OVERPASS_SHARDS = int(os.getenv('OVERPASS_SHARDS', '0'))
+OVERPASS_CONCURRENCY = int(os.getenv('OVERPASS_CONCURRENCY', '2'))
+
+# allow requests to the loopback interface, for testing against a local server like fake_overpass.py
+HTTP_ALLOW_LOOPBACK = os.getenv('HTTP_ALLOW_LOOPBACK', '0') == '1'
 COUNTRIES_GEOJSON_URL = (
     'https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_sovereignty.geojson'
 )
 
 GEOJSON_DIR = Path('geojson')
+CACHE_DIR = Path(os.getenv('CACHE_DIR', 'cache'))
+
+# reuse assembled country geometries when their member ways did not change
+GEOMETRY_CACHE = os.getenv('GEOMETRY_CACHE', '1') == '1'
+GEOMETRY_CACHE_DIR = CACHE_DIR / 'geometry'
+
+# save the simplification topology after each run, so resimplify.py can regenerate outputs offline
+TOPOLOGY_SNAPSHOT = os.getenv('TOPOLOGY_SNAPSHOT', '1') == '1'
+TOPOLOGY_SNAPSHOT_DIR = CACHE_DIR / 'topology'
+
+# '' - conditional requests for cacheable downloads
+# 'record' - also store every Overpass response
+# 'replay' - serve all responses from the cache, without network access
+HTTP_CACHE_MODE = os.getenv('HTTP_CACHE_MODE', '')
+HTTP_CACHE_DIR = CACHE_DIR / 'http'
 
 GEOJSON_QUALITIES = (
     0.00001,
@@ -24,3 +46,44 @@ GEOJSON_QUALITIES = (
 )
 
 BEST_GEOJSON_QUALITY = min(GEOJSON_QUALITIES)
+
+# number of decimal places of the output coordinates per quality, e.g. '0.1:3,0.01:4',
+# qualities not listed keep full precision
+GEOJSON_PRECISION: dict[float, int] = {
+    float(q): int(precision)
+    for q, _, precision in (item.partition(':') for item in os.getenv('GEOJSON_PRECISION', '').split(',') if item)
+}
+
+# also write TopoJSON files, with shared borders stored once
+TOPOJSON = os.getenv('TOPOJSON', '1') == '1'
+
+# also write FlatGeobuf files, with a spatial index for bbox queries and range reads
+FLATGEOBUF = os.getenv('FLATGEOBUF', '0') == '1'
+
+# also write one GeoJSON file per country and quality, with a manifest of their bboxes and hashes
+COUNTRY_SPLIT = os.getenv('COUNTRY_SPLIT', '0') == '1'
+COUNTRY_SPLIT_DIR = GEOJSON_DIR / 'countries'
+
+# also write a vector tiles pyramid in the MBTiles format
+VECTOR_TILES = os.getenv('VECTOR_TILES', '0') == '1'
+VECTOR_TILES_MAX_ZOOM = int(os.getenv('VECTOR_TILES_MAX_ZOOM', '8'))
+
+# pre-compressed copies of the text outputs, written next to them
+OUTPUT_COMPRESSION = tuple(fmt for fmt in os.getenv('OUTPUT_COMPRESSION', 'gz,br,zst').split(',') if fmt)
+# zopfli iterations (0 uses gzip level 9), brotli quality (0-11) and zstd level (1-22),
+# lower them to trade size for speed on the largest files
+OUTPUT_ZOPFLI_ITERATIONS = int(os.getenv('OUTPUT_ZOPFLI_ITERATIONS', '15'))
+OUTPUT_BROTLI_QUALITY = int(os.getenv('OUTPUT_BROTLI_QUALITY', '11'))
+OUTPUT_ZSTD_LEVEL = int(os.getenv('OUTPUT_ZSTD_LEVEL', '22'))
+
+# write cProfile stats of the matching instrumented stages, e.g. 'topology,simplify.*'
+PROFILE_STAGES = tuple(pattern for pattern in os.getenv('PROFILE_STAGES', '').split(',') if pattern)
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', 'profile'))
+
+# download each member way once, with node ids, and use it to detect shared borders
+SHARED_WAYS = os.getenv('SHARED_WAYS', '0') == '1'
+
+# number of worker processes for geometry assembly, simplification and vector tiles, 0 disables parallelism
+ASSEMBLY_WORKERS = int(os.getenv('ASSEMBLY_WORKERS', '0'))
+SIMPLIFY_WORKERS = int(os.getenv('SIMPLIFY_WORKERS', '0'))
+VECTOR_TILES_WORKERS = int(os.getenv('VECTOR_TILES_WORKERS', '0'))
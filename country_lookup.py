@@ -0,0 +1,169 @@
+import json
+import sys
+import time
+from collections.abc import Sequence
+from hashlib import blake2b
+from itertools import pairwise
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+from shapely import STRtree, box, from_wkb, points, to_wkb
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+
+from config import BEST_GEOJSON_QUALITY, CACHE_DIR, GEOJSON_DIR
+from osm_countries_gen import OSMCountry
+from utils import atomic_path, quality_suffix
+
+# increase when the index format changes to invalidate old entries
+_VERSION = 1
+_LOOKUP_CACHE_DIR = CACHE_DIR / 'lookup'
+
+# grid cell values, non-negative values are country indices
+_CELL_EMPTY = -1
+_CELL_MIXED = -2
+
+
+class CountryLookup:
+    __slots__ = ('_cell_size', '_cells', '_codes', '_geoms', '_tree')
+    _geoms: NDArray[np.object_]
+    _codes: NDArray[np.str_]
+    _tree: STRtree
+    _cell_size: float
+    _cells: NDArray[np.int32]
+
+    def __init__(
+        self,
+        geoms: Sequence[BaseGeometry] | NDArray[np.object_],
+        codes: Sequence[str | None],
+        *,
+        cell_size: float = 0.5,
+        cells: NDArray[np.int32] | None = None,
+    ):
+        # points resolve to the lowest index country intersecting them, -1 when there is none
+        self._geoms = np.asarray(geoms, dtype=np.object_)
+        self._codes = np.array([*(code or '' for code in codes), ''])  # index -1 maps to ''
+        self._tree = STRtree(self._geoms)
+        self._cell_size = cell_size
+        self._cells = cells if cells is not None else self._build_cells()
+
+    @classmethod
+    def from_countries(
+        cls, countries: Sequence[OSMCountry], q: float = BEST_GEOJSON_QUALITY, **kwargs
+    ) -> 'CountryLookup':
+        geoms = [country.geometry[q] for country in countries]
+        codes = [country.tags.get('ISO3166-1') for country in countries]
+        return cls(geoms, codes, **kwargs)
+
+    @classmethod
+    def from_geojson(cls, path: Path, *, cache: bool = True, cell_size: float = 0.5) -> 'CountryLookup':
+        # the cache entry is reused as long as the GeoJSON file contents are unchanged
+        data = path.read_bytes()
+        h = blake2b(_VERSION.to_bytes(4, 'little'), digest_size=16)
+        h.update(np.float64(cell_size).tobytes())
+        h.update(data)
+        key = h.hexdigest()
+        cache_path = _LOOKUP_CACHE_DIR / f'{path.stem}.npz'
+
+        if cache:
+            try:
+                with np.load(cache_path) as npz:
+                    if str(npz['key']) == key:
+                        wkb_offsets = npz['wkb_offsets']
+                        wkb = npz['wkb'].tobytes()
+                        geoms = from_wkb([wkb[start:end] for start, end in pairwise(wkb_offsets.tolist())])
+                        return cls(geoms, npz['codes'].tolist(), cell_size=cell_size, cells=npz['cells'])
+            except FileNotFoundError:
+                pass
+
+        features = json.loads(data)['features']
+        del data
+        geoms = [shape(feature['geometry']) for feature in features]
+        codes = [feature['properties']['tags'].get('ISO3166-1') for feature in features]
+        self = cls(geoms, codes, cell_size=cell_size)
+
+        if cache:
+            wkbs = to_wkb(self._geoms)
+            _LOOKUP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # np.savez appends .npz to other file names
+            with atomic_path(cache_path, '.tmp.npz') as temp_path:
+                np.savez(
+                    temp_path,
+                    key=np.str_(key),
+                    codes=self._codes[:-1],
+                    cells=self._cells,
+                    wkb=np.frombuffer(b''.join(wkbs), dtype=np.uint8),
+                    wkb_offsets=np.cumsum([0, *map(len, wkbs)]),
+                )
+        return self
+
+    def lookup(self, lon: ArrayLike, lat: ArrayLike) -> NDArray[np.int32]:
+        input_shape = np.shape(lon)
+        lon = np.ravel(lon).astype(np.float64, copy=False)
+        lat = np.ravel(lat).astype(np.float64, copy=False)
+        cells_y, cells_x = self._cells.shape
+        x = np.floor((lon + 180) / self._cell_size)
+        y = np.floor((lat + 90) / self._cell_size)
+        inside = (x >= 0) & (x < cells_x) & (y >= 0) & (y < cells_y)
+        result = np.full(len(lon), _CELL_MIXED, dtype=np.int32)
+        result[inside] = self._cells[y[inside].astype(np.intp), x[inside].astype(np.intp)]
+
+        # test the points in cells shared by several countries against the geometries
+        mixed = np.flatnonzero(result == _CELL_MIXED)
+        result[mixed] = _CELL_EMPTY
+        if len(mixed):
+            points_indices, geoms_indices = self._tree.query(points(lon[mixed], lat[mixed]), predicate='intersects')
+            order = np.lexsort((geoms_indices, points_indices))
+            points_indices = points_indices[order]
+            first = np.flatnonzero(np.diff(points_indices, prepend=-1))
+            result[mixed[points_indices[first]]] = geoms_indices[order][first]
+        return result.reshape(input_shape)
+
+    def lookup_codes(self, lon: ArrayLike, lat: ArrayLike) -> NDArray[np.str_]:
+        # ISO3166-1 codes, empty strings when there is no country or code
+        return self._codes[self.lookup(lon, lat)]
+
+    def _build_cells(self) -> NDArray[np.int32]:
+        # a cell resolves to a country when every country intersecting it also contains it
+        cell_size = self._cell_size
+        cells_x = int(np.ceil(360 / cell_size))
+        cells_y = int(np.ceil(180 / cell_size))
+        min_x = np.arange(cells_x) * cell_size - 180
+        min_y = np.arange(cells_y) * cell_size - 90
+        min_x, min_y = np.meshgrid(min_x, min_y)
+        cells_boxes = box(min_x.ravel(), min_y.ravel(), min_x.ravel() + cell_size, min_y.ravel() + cell_size)
+        intersects_counts = np.bincount(
+            self._tree.query(cells_boxes, predicate='intersects')[0], minlength=len(cells_boxes)
+        )
+        within_cells, within_geoms = self._tree.query(cells_boxes, predicate='within')
+        within_counts = np.bincount(within_cells, minlength=len(cells_boxes))
+        within_first = np.full(len(cells_boxes), len(self._geoms), dtype=np.int64)
+        np.minimum.at(within_first, within_cells, within_geoms)
+
+        cells = np.full(len(cells_boxes), _CELL_MIXED, dtype=np.int32)
+        cells[intersects_counts == 0] = _CELL_EMPTY
+        resolved = (intersects_counts > 0) & (within_counts == intersects_counts)
+        cells[resolved] = within_first[resolved]
+        return cells.reshape(cells_y, cells_x)
+
+
+def _benchmark(path: Path, n: int = 1_000_000) -> None:
+    ts = time.perf_counter()
+    lookup = CountryLookup.from_geojson(path)
+    print(f'Loaded {path} in {time.perf_counter() - ts:.2f}s')
+
+    rng = np.random.default_rng(42)
+    lon = rng.uniform(-180, 180, n)
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))  # uniform over the sphere surface
+    ts = time.perf_counter()
+    codes = lookup.lookup_codes(lon, lat)
+    elapsed = time.perf_counter() - ts
+    print(f'Looked up {n} points in {elapsed:.2f}s ({n / elapsed:,.0f} points/s), {np.count_nonzero(codes)} matched')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        _benchmark(Path(sys.argv[1]))
+    else:
+        _benchmark(GEOJSON_DIR / f'osm-countries-{quality_suffix(BEST_GEOJSON_QUALITY)}.geojson')
@@ -0,0 +1,77 @@
+import json
+import re
+from collections.abc import Sequence
+from hashlib import sha256
+from pathlib import Path
+
+from shapely import bounds, is_empty
+
+from geojson_writer import write_geojson
+from osm_countries_gen import OSMCountry
+from utils import atomic_path
+
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9-]')
+
+
+def write_country_split(
+    directory: Path,
+    countries: Sequence[OSMCountry],
+    q: float,
+    data_timestamp: float,
+    *,
+    precision: int | None = None,
+) -> list[Path]:
+    # one GeoJSON file per country, named by ISO3166-1 code, and a manifest for picking files by bbox
+    directory.mkdir(parents=True, exist_ok=True)
+    names = _file_names(countries)
+    geoms = [country.geometry[q] for country in countries]
+    countries_bounds = bounds(geoms)
+    if precision is not None:
+        countries_bounds = countries_bounds.round(precision)  # match the written coordinates
+    # empty geometries have NaN bounds, which are not valid JSON
+    countries_empty = is_empty(geoms).tolist()
+
+    paths: list[Path] = []
+    entries: list[dict] = []
+    for country, name, bbox, empty in zip(countries, names, countries_bounds.tolist(), countries_empty, strict=True):
+        path = directory / f'{name}.geojson'
+        write_geojson(path, (country,), q, data_timestamp, precision=precision)
+        data = path.read_bytes()
+        paths.append(path)
+        entries.append({
+            'code': country.tags.get('ISO3166-1'),
+            'name': country.tags.get('name'),
+            'file': path.name,
+            'bbox': None if empty else bbox,
+            'representative_point': country.representative_point['coordinates'],
+            'size': len(data),
+            'sha256': sha256(data).hexdigest(),
+        })
+
+    # remove files of countries that are gone, including their compressed copies
+    names_set = set(names)
+    for path in directory.iterdir():
+        if path.name.split('.', 1)[0] not in names_set and path.name != 'manifest.json':
+            path.unlink()
+
+    manifest = {'quality': q, 'timestamp': data_timestamp, 'countries': entries}
+    manifest_path = directory / 'manifest.json'
+    with atomic_path(manifest_path) as temp_path:
+        temp_path.write_text(json.dumps(manifest, ensure_ascii=False, allow_nan=False, separators=(',', ':')))
+    return paths
+
+
+def _file_names(countries: Sequence[OSMCountry]) -> list[str]:
+    # codes are not guaranteed to be unique, repeated ones get a numeric suffix
+    names: list[str] = []
+    used: set[str] = set()
+    for country in countries:
+        base = _UNSAFE_RE.sub('_', country.tags.get('ISO3166-1') or 'unknown')
+        name = base
+        i = 1
+        while name in used:
+            i += 1
+            name = f'{base}-{i}'
+        used.add(name)
+        names.append(name)
+    return names
@@ -0,0 +1,269 @@
+import argparse
+import json
+import re
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager, suppress
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from synthetic import split_rings, synthetic_countries
+
+# a local stand-in for the Overpass API, supporting the subset of the query language used by this project:
+# [out:json][timeout:N][date:"..."]; (rel[filters...]; rel(id); ...); out body|geom qt; way(r); out skel geom qt;
+# the date setting is accepted, but the data has no history
+# run with HTTP_ALLOW_LOOPBACK=1 OVERPASS_API_INTERPRETER=http://127.0.0.1:<port>/api/interpreter
+
+_SETTINGS_RE = re.compile(r'(?:\[[^\]]*\])+;')
+_STRING = r'"((?:[^"\\]|\\.)*)"|([\w:-]+)'
+_FILTER_RE = re.compile(rf'\[\s*(?:{_STRING})\s*(?:(!?~|!?=)\s*(?:{_STRING})\s*)?\]')
+_REL_ID_RE = re.compile(r'rel\((\d+)\)')
+_OUT_RE = re.compile(r'out((?:\s+\w+)*)')
+
+
+class FakeOverpass:
+    __slots__ = (
+        '_active',
+        '_lock',
+        'delay',
+        'fail_requests',
+        'max_active',
+        'queries',
+        'relations',
+        'timestamp',
+        'timestamps',
+        'ways',
+    )
+
+    def __init__(self, elements: Sequence[dict], timestamp: str = '2024-01-01T00:00:00Z'):
+        self.relations = [e for e in elements if e['type'] == 'relation']
+        self.ways = {e['id']: e for e in elements if e['type'] == 'way'}
+        self.timestamp = timestamp
+        self.timestamps: list[str] = []  # database timestamps of upcoming answered requests, before timestamp
+        self.fail_requests = 0  # number of upcoming requests answered with 504 Gateway Timeout
+        self.delay = 0.0  # seconds to wait before answering
+        self.queries: list[str] = []
+        self.max_active = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def handle(self, query: str) -> tuple[int, Iterator[bytes]]:
+        with self._lock:
+            self.queries.append(query)
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+            fail = self.fail_requests > 0
+            if fail:
+                self.fail_requests -= 1
+            timestamp = self.timestamp if fail or not self.timestamps else self.timestamps.pop(0)
+        try:
+            time.sleep(self.delay)
+            if fail:
+                return 504, iter((b'Gateway Timeout',))
+            elements = self._evaluate(query)
+            return 200, self._encode(elements, timestamp)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _evaluate(self, query: str) -> list[dict]:
+        statements = _split_statements(_SETTINGS_RE.sub('', query, count=1))
+        result: list[dict] = []
+        current: list[dict] = []
+        for statement in statements:
+            if statement.startswith('('):
+                union = {e['id']: e for inner in _split_statements(statement[1:-1]) for e in self._select(inner)}
+                current = list(union.values())
+            elif statement == 'way(r)':
+                refs = {
+                    m['ref'] for e in current if e['type'] == 'relation' for m in e['members'] if m['type'] == 'way'
+                }
+                current = [self.ways[ref] for ref in sorted(refs) if ref in self.ways]
+            elif match := _OUT_RE.fullmatch(statement):
+                modes = set(match[1].split())
+                result.extend(self._output(e, modes) for e in current)
+            else:
+                current = self._select(statement)
+        return result
+
+    def _select(self, statement: str) -> list[dict]:
+        if match := _REL_ID_RE.fullmatch(statement):
+            return [e for e in self.relations if e['id'] == int(match[1])]
+        if not statement.startswith('rel['):
+            raise ValueError(f'Unsupported statement: {statement}')
+        filters = statement[3:]
+        pos = 0
+        relations = self.relations
+        while pos < len(filters):
+            match = _FILTER_RE.match(filters, pos)
+            if match is None:
+                raise ValueError(f'Unsupported filter: {filters[pos:]}')
+            pos = match.end()
+            key = match[1] if match[1] is not None else match[2]
+            value = match[4] if match[4] is not None else match[5]
+            relations = [e for e in relations if _match_filter(e.get('tags', {}), key, match[3], value)]
+        return relations
+
+    def _output(self, element: dict, modes: set[str]) -> dict:
+        if element['type'] == 'way':
+            result = {'type': 'way', 'id': element['id'], 'nodes': element['nodes']}
+            if 'skel' not in modes:
+                result['tags'] = element.get('tags', {})
+            if 'geom' in modes:
+                result['geometry'] = element['geometry']
+            return result
+
+        members = []
+        for member in element['members']:
+            result = {'type': member['type'], 'ref': member['ref'], 'role': member['role']}
+            if 'geom' in modes and member['type'] == 'way':
+                # recorded responses have member geometries, synthetic data has separate ways
+                geometry = member.get('geometry')
+                result['geometry'] = geometry if geometry is not None else self.ways[member['ref']]['geometry']
+            members.append(result)
+        return {'type': 'relation', 'id': element['id'], 'members': members, 'tags': element.get('tags', {})}
+
+    def _encode(self, elements: list[dict], timestamp: str) -> Iterator[bytes]:
+        header = {'version': 0.6, 'generator': 'fake_overpass', 'osm3s': {'timestamp_osm_base': timestamp}}
+        yield json.dumps(header).removesuffix('}').encode() + b', "elements": [\n'
+        for i, element in enumerate(elements):
+            yield (b',\n' if i else b'') + json.dumps(element).encode()
+        yield b'\n]\n}\n'
+
+
+def _split_statements(query: str) -> list[str]:
+    # split on top-level semicolons, ignoring the ones in quotes, brackets and parentheses
+    statements: list[str] = []
+    depth = 0
+    quoted = False
+    start = 0
+    for i, char in enumerate(query):
+        if quoted:
+            quoted = char != '"' or query[i - 1] == '\\'
+        elif char == '"':
+            quoted = True
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ';' and depth == 0:
+            if statement := query[start:i].strip():
+                statements.append(statement)
+            start = i + 1
+    if query[start:].strip():
+        raise ValueError(f'Missing semicolon after: {query[start:]}')
+    return statements
+
+
+def _match_filter(tags: dict[str, str], key: str, op: str | None, value: str | None) -> bool:
+    tag = tags.get(key)
+    if op is None:
+        return tag is not None
+    if value is None:
+        raise ValueError(f'Missing value for operator: {op}')
+    match op:
+        case '=':
+            return tag == value
+        case '!=':
+            return tag != value
+        case '~':
+            return tag is not None and re.search(value, tag) is not None
+        case '!~':
+            return tag is None or re.search(value, tag) is None
+    raise ValueError(f'Unsupported operator: {op}')
+
+
+def synthetic_elements(countries: int = 200, *, seed: int = 0, way_size: int = 100) -> list[dict]:
+    # relations and member ways of synthetic countries, with ISO3166-1 codes spread over the alphabet
+    relations: list[dict] = []
+    ways: list[dict] = []
+    nodes: dict[tuple[float, float], int] = {}
+    for i, geom in enumerate(synthetic_countries(countries, seed=seed)):
+        members = []
+        for role, segments in zip(('outer', 'inner'), split_rings(geom, way_size), strict=True):
+            for segment in segments:
+                way_id = len(ways) + 1
+                coords = segment.tolist()
+                ways.append({
+                    'type': 'way',
+                    'id': way_id,
+                    'nodes': [nodes.setdefault((x, y), len(nodes) + 1) for x, y in coords],
+                    'geometry': [{'lat': y, 'lon': x} for x, y in coords],
+                })
+                members.append({'type': 'way', 'ref': way_id, 'role': role})
+        code = f'{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}'
+        relations.append({
+            'type': 'relation',
+            'id': i + 1,
+            'members': members,
+            'tags': {
+                'boundary': 'administrative',
+                'admin_level': '2',
+                'ISO3166-1': code,
+                'name': f'Country {code}',
+            },
+        })
+    return relations + ways
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def __init__(self, overpass: FakeOverpass, *args):
+        # set before the base class handles the request
+        self.overpass = overpass
+        super().__init__(*args)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        query = parse_qs(body)['data'][0]
+        try:
+            status, chunks = self.overpass.handle(query)
+        except ValueError as e:
+            status, chunks = 400, iter((str(e).encode(),))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json' if status == 200 else 'text/plain')
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+@contextmanager
+def serve(overpass: FakeOverpass, port: int = 0) -> Iterator[str]:
+    # serve in a background thread, yields the interpreter URL
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(_Handler, overpass))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}/api/interpreter'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve a fake Overpass API on the loopback interface')
+    parser.add_argument('--data', type=Path, help='Overpass JSON response with relations and ways to serve')
+    parser.add_argument('--countries', type=int, default=200, help='number of synthetic countries, without --data')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fail', type=int, default=0, help='answer the first requests with 504 Gateway Timeout')
+    parser.add_argument('--delay', type=float, default=0, help='seconds to wait before each response')
+    args = parser.parse_args()
+
+    elements = json.loads(args.data.read_bytes())['elements'] if args.data else synthetic_elements(args.countries)
+    overpass = FakeOverpass(elements)
+    overpass.fail_requests = args.fail
+    overpass.delay = args.delay
+    with serve(overpass, args.port) as url:
+        print(f'Serving {len(overpass.relations)} relations and {len(overpass.ways)} ways at {url}')
+        with suppress(KeyboardInterrupt):
+            threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
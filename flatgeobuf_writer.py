@@ -0,0 +1,308 @@
+import json
+import struct
+from collections.abc import Sequence
+from itertools import pairwise
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+from shapely import get_coordinates, get_num_coordinates, get_parts, get_rings
+from shapely.geometry.base import BaseGeometry
+
+from osm_countries_gen import OSMCountry
+
+# see https://github.com/flatgeobuf/flatgeobuf/tree/master/src/fbs for the schemas
+_MAGIC = b'fgb\x03fgb\x01'
+_INDEX_NODE_SIZE = 16
+
+_GEOMETRY_TYPE_POLYGON = 3
+_GEOMETRY_TYPE_MULTIPOLYGON = 6
+
+_COLUMN_TYPE_DOUBLE = 10
+_COLUMN_TYPE_JSON = 12
+_COLUMNS = (
+    ('tags', _COLUMN_TYPE_JSON),
+    ('timestamp', _COLUMN_TYPE_DOUBLE),
+    ('representative_point', _COLUMN_TYPE_JSON),
+)
+
+_NODE_ITEM_DTYPE = np.dtype([
+    ('min_x', '<f8'),
+    ('min_y', '<f8'),
+    ('max_x', '<f8'),
+    ('max_y', '<f8'),
+    ('offset', '<u8'),
+])
+
+# table fields are (format, value) pairs indexed by field id, None for absent fields,
+# the format is a struct format for scalars, or one of: 'str', 'vec', 'table', 'tables'
+_Table = Sequence[tuple[str, Any] | None]
+
+
+def write_flatgeobuf(
+    path: Path,
+    countries: Sequence[OSMCountry],
+    q: float,
+    data_timestamp: float,
+    *,
+    precision: int | None = None,
+) -> None:
+    # features are stored in the packed Hilbert R-tree order, not in the input order
+    features: list[bytes] = []
+    features_bounds = np.empty((len(countries), 4), dtype=np.float64)
+    for i, country in enumerate(countries):
+        geometry, features_bounds[i] = _encode_geometry(country.geometry[q], precision)
+        properties = _encode_properties(country, data_timestamp)
+        features.append(_finish((('table', geometry), ('vec', np.frombuffer(properties, dtype=np.uint8)))))
+
+    order = _hilbert_order(features_bounds)
+    features = [features[i] for i in order.tolist()]
+    features_bounds = features_bounds[order]
+    features_sizes = np.array([4 + len(feature) for feature in features], dtype=np.uint64)
+    features_offsets = np.cumsum(features_sizes) - features_sizes
+
+    if features:
+        envelope = np.array((*features_bounds[:, :2].min(axis=0), *features_bounds[:, 2:].max(axis=0)))
+        index = _pack_rtree(features_bounds, features_offsets, _INDEX_NODE_SIZE)
+    else:
+        envelope = None
+        index = b''
+
+    header = _finish((
+        ('str', path.stem),
+        ('vec', envelope) if envelope is not None else None,
+        ('B', _GEOMETRY_TYPE_MULTIPOLYGON),
+        None,  # has_z
+        None,  # has_m
+        None,  # has_t
+        None,  # has_tm
+        ('tables', [(('str', name), ('B', column_type)) for name, column_type in _COLUMNS]),
+        ('Q', len(features)),
+        ('H', _INDEX_NODE_SIZE if features else 0),
+        ('table', (('str', 'EPSG'), ('i', 4326))),
+    ))
+
+    with path.open('wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(index)
+        for feature in features:
+            f.write(struct.pack('<I', len(feature)))
+            f.write(feature)
+
+
+def _encode_geometry(geom: BaseGeometry, precision: int | None) -> tuple[_Table, NDArray[np.floating]]:
+    geom_type = geom.geom_type
+    if geom_type not in {'Polygon', 'MultiPolygon'}:
+        raise ValueError(f'Unsupported geometry type: {geom_type!r}')
+
+    # every feature is a MultiPolygon, matching the header geometry type
+    polys = get_parts(geom)
+    rings, polys_indices = get_rings(polys, return_index=True)
+    coords = get_coordinates(rings)
+    if precision is not None:
+        coords = coords.round(precision)
+    rings_ends = np.cumsum(get_num_coordinates(rings))
+    polys_bounds = pairwise((0, *np.searchsorted(polys_indices, np.arange(len(polys)), side='right').tolist()))
+
+    parts: list[_Table] = []
+    for poly_start, poly_end in polys_bounds:
+        coords_start = rings_ends[poly_start - 1] if poly_start else 0
+        coords_end = rings_ends[poly_end - 1]
+        ends = (rings_ends[poly_start:poly_end] - coords_start).astype('<u4')
+        parts.append((
+            ('vec', ends) if len(ends) > 1 else None,
+            ('vec', coords[coords_start:coords_end].ravel()),
+            None,  # z
+            None,  # m
+            None,  # t
+            None,  # tm
+            ('B', _GEOMETRY_TYPE_POLYGON),
+        ))
+
+    bounds = np.array((*coords.min(axis=0), *coords.max(axis=0))) if len(coords) else np.zeros(4)
+    geometry = (None, None, None, None, None, None, ('B', _GEOMETRY_TYPE_MULTIPOLYGON), ('tables', parts))
+    return geometry, bounds
+
+
+def _encode_properties(country: OSMCountry, data_timestamp: float) -> bytes:
+    result = bytearray()
+    for i, value in enumerate((country.tags, data_timestamp, country.representative_point)):
+        result += struct.pack('<H', i)
+        if _COLUMNS[i][1] == _COLUMN_TYPE_DOUBLE:
+            result += struct.pack('<d', value)
+        else:
+            encoded = json.dumps(value, ensure_ascii=False, check_circular=False, allow_nan=False).encode()
+            result += struct.pack('<I', len(encoded))
+            result += encoded
+    return bytes(result)
+
+
+def _hilbert_order(bounds: NDArray[np.floating]) -> NDArray[np.integer]:
+    if not len(bounds):
+        return np.empty(0, dtype=np.intp)
+    hilbert_max = 0xFFFF
+    min_xy = bounds[:, :2].min(axis=0)
+    size = bounds[:, 2:].max(axis=0) - min_xy
+    centers = (bounds[:, :2] + bounds[:, 2:]) / 2
+    cells = np.divide(hilbert_max * (centers - min_xy), size, out=np.zeros_like(centers), where=size > 0)
+    cells = cells.astype(np.uint32)
+    return np.argsort(_hilbert(cells[:, 0], cells[:, 1]), kind='stable')
+
+
+def _hilbert(x: NDArray[np.integer], y: NDArray[np.integer]) -> NDArray[np.integer]:
+    # position along the Hilbert curve of 16-bit coordinates, given as uint32 arrays,
+    # from https://github.com/rawrunprotected/hilbert_curves
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    a, b, c, d = (
+        a | (b >> 1),
+        (a >> 1) ^ a,
+        ((c >> 1) ^ (b & (d >> 1))) ^ c,
+        ((a & (c >> 1)) ^ (d >> 1)) ^ d,
+    )
+    for shift in (2, 4):
+        a, b, c, d = (
+            (a & (a >> shift)) ^ (b & (b >> shift)),
+            (a & (b >> shift)) ^ (b & ((a ^ b) >> shift)),
+            c ^ (a & (c >> shift)) ^ (b & (d >> shift)),
+            d ^ (b & (c >> shift)) ^ ((a ^ b) & (d >> shift)),
+        )
+    c ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    d ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+
+    a = c ^ (c >> 1)
+    b = d ^ (d >> 1)
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+    return (_interleave(i1) << 1) | _interleave(i0)
+
+
+def _interleave(x: NDArray[np.integer]) -> NDArray[np.integer]:
+    x = (x | (x << 8)) & 0x00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F
+    x = (x | (x << 2)) & 0x33333333
+    return (x | (x << 1)) & 0x55555555
+
+
+def _pack_rtree(bounds: NDArray[np.floating], offsets: NDArray[np.integer], node_size: int) -> bytes:
+    # nodes are stored top-down, level by level, with the leaves at the end;
+    # there is always a root level above the leaves, even for a single item, like in calcTreeSize
+    n = len(bounds)
+    levels_sizes = [n]
+    while True:
+        n = -(-n // node_size)
+        levels_sizes.append(n)
+        if n == 1:
+            break
+    nodes_len = sum(levels_sizes)
+    levels_offsets = (nodes_len - np.cumsum(levels_sizes)).tolist()
+
+    nodes = np.empty(nodes_len, dtype=_NODE_ITEM_DTYPE)
+    leaves = nodes[levels_offsets[0] :]
+    leaves['min_x'], leaves['min_y'], leaves['max_x'], leaves['max_y'] = bounds.T
+    leaves['offset'] = offsets
+
+    # internal nodes point to the index of their first child
+    for level, level_offset in enumerate(levels_offsets[:-1]):
+        children = nodes[level_offset : level_offset + levels_sizes[level]]
+        children_starts = np.arange(0, len(children), node_size)
+        parents = nodes[levels_offsets[level + 1] : levels_offsets[level + 1] + levels_sizes[level + 1]]
+        parents['min_x'] = np.minimum.reduceat(children['min_x'], children_starts)
+        parents['min_y'] = np.minimum.reduceat(children['min_y'], children_starts)
+        parents['max_x'] = np.maximum.reduceat(children['max_x'], children_starts)
+        parents['max_y'] = np.maximum.reduceat(children['max_y'], children_starts)
+        parents['offset'] = children_starts + level_offset
+    return nodes.tobytes()
+
+
+def _finish(root: _Table) -> bytes:
+    # minimal FlatBuffers serializer, objects are laid out after the tables referencing them
+    buf = bytearray(4)
+    struct.pack_into('<I', buf, 0, _write_table(buf, root))
+    return bytes(buf)
+
+
+def _write_table(buf: bytearray, fields: _Table) -> int:
+    inline: list[tuple[int, str, Any, int]] = []
+    for field_id, field in enumerate(fields):
+        if field is None:
+            continue
+        fmt, value = field
+        size = struct.calcsize('<' + fmt) if len(fmt) == 1 else 4
+        inline.append((field_id, fmt, value, size))
+    inline.sort(key=lambda f: f[3], reverse=True)
+
+    fields_offsets = [0] * len(fields)
+    table_size = 4  # soffset to the vtable
+    for field_id, _, _, size in inline:
+        table_size = -(-table_size // size) * size
+        fields_offsets[field_id] = table_size
+        table_size += size
+
+    _align(buf, 2)
+    vtable_pos = len(buf)
+    buf += struct.pack(f'<{2 + len(fields)}H', 4 + 2 * len(fields), table_size, *fields_offsets)
+    _align(buf, max((f[3] for f in inline), default=4))
+    table_pos = len(buf)
+    buf += bytes(table_size)
+    struct.pack_into('<i', buf, table_pos, table_pos - vtable_pos)
+
+    for field_id, fmt, value, _ in inline:
+        field_pos = table_pos + fields_offsets[field_id]
+        if len(fmt) == 1:
+            struct.pack_into('<' + fmt, buf, field_pos, value)
+            continue
+        match fmt:
+            case 'str':
+                child_pos = _write_string(buf, value)
+            case 'vec':
+                child_pos = _write_vector(buf, value)
+            case 'table':
+                child_pos = _write_table(buf, value)
+            case 'tables':
+                child_pos = _write_tables(buf, value)
+            case _:
+                raise ValueError(f'Unsupported field format {fmt!r}')
+        struct.pack_into('<I', buf, field_pos, child_pos - field_pos)
+
+    return table_pos
+
+
+def _write_string(buf: bytearray, value: str) -> int:
+    encoded = value.encode()
+    _align(buf, 4)
+    pos = len(buf)
+    buf += struct.pack('<I', len(encoded))
+    buf += encoded
+    buf += b'\0'
+    return pos
+
+
+def _write_vector(buf: bytearray, value: NDArray) -> int:
+    # the length prefix is aligned to 4 bytes and the elements to their own size
+    _align(buf, max(value.itemsize, 4), 4)
+    pos = len(buf)
+    buf += struct.pack('<I', len(value))
+    buf += value.astype(value.dtype.newbyteorder('<'), copy=False).tobytes()
+    return pos
+
+
+def _write_tables(buf: bytearray, value: Sequence[_Table]) -> int:
+    _align(buf, 4)
+    pos = len(buf)
+    buf += struct.pack('<I', len(value))
+    buf += bytes(4 * len(value))
+    for i, table in enumerate(value):
+        item_pos = pos + 4 + 4 * i
+        struct.pack_into('<I', buf, item_pos, _write_table(buf, table) - item_pos)
+    return pos
+
+
+def _align(buf: bytearray, alignment: int, extra: int = 0) -> None:
+    buf += bytes(-(len(buf) + extra) % alignment)
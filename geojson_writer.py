@@ -0,0 +1,84 @@
+import json
+from collections.abc import Iterable
+from itertools import pairwise
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+from shapely import get_coordinates, get_num_coordinates, get_parts, get_rings
+from shapely.geometry.base import BaseGeometry
+
+from osm_countries_gen import OSMCountry
+
+_CRS = {
+    'type': 'name',
+    'properties': {
+        'name': 'urn:ogc:def:crs:OGC:1.3:CRS84',
+    },
+}
+
+
+def write_geojson(
+    path: Path,
+    countries: Iterable[OSMCountry],
+    q: float,
+    data_timestamp: float,
+    *,
+    precision: int | None = None,
+) -> None:
+    # write features one at a time, the output is equivalent to json.dumps of the whole collection
+    with path.open('w') as f:
+        f.write(f'{{"type": "FeatureCollection", "name": {_dumps(path.stem)}, "crs": {_dumps(_CRS)}, "features": [')
+        for i, country in enumerate(countries):
+            if i:
+                f.write(', ')
+            properties = {
+                'tags': country.tags,
+                'timestamp': data_timestamp,
+                'representative_point': country.representative_point,
+            }
+            f.write(f'{{"type": "Feature", "properties": {_dumps(properties)}, "geometry": ')
+            f.write(encode_geometry(country.geometry[q], precision))
+            f.write('}')
+        f.write(']}')
+
+
+def encode_geometry(geom: BaseGeometry, precision: int | None = None) -> str:
+    geom_type = geom.geom_type
+    if geom_type not in {'Polygon', 'MultiPolygon'}:
+        raise ValueError(f'Unsupported geometry type: {geom_type!r}')
+
+    polys = get_parts(geom)
+    rings, polys_indices = get_rings(polys, return_index=True)
+    points = _encode_points(get_coordinates(rings), precision)
+    rings_bounds = tuple(pairwise((0, *np.cumsum(get_num_coordinates(rings)).tolist())))
+    polys_bounds = pairwise((0, *np.searchsorted(polys_indices, np.arange(len(polys)), side='right').tolist()))
+
+    encoded_polys = [
+        '['
+        + ', '.join(
+            '[' + ', '.join(points[ring_start:ring_end]) + ']'
+            for ring_start, ring_end in rings_bounds[poly_start:poly_end]
+        )
+        + ']'
+        for poly_start, poly_end in polys_bounds
+    ]
+
+    if geom_type == 'Polygon':
+        coordinates = encoded_polys[0] if encoded_polys else '[]'
+    else:
+        coordinates = '[' + ', '.join(encoded_polys) + ']'
+    return f'{{"type": "{geom_type}", "coordinates": {coordinates}}}'
+
+
+def _encode_points(coords: NDArray[np.floating], precision: int | None) -> list[str]:
+    if precision is not None:
+        coords = coords.round(precision)
+    if not np.isfinite(coords).all():
+        raise ValueError('Out of range float values are not JSON compliant')
+    values = coords.ravel().tolist()
+    return list(map('[{!r}, {!r}]'.format, values[0::2], values[1::2]))
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, check_circular=False, allow_nan=False)
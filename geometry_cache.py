@@ -0,0 +1,46 @@
+from collections.abc import Sequence
+from hashlib import blake2b
+
+import numpy as np
+from numpy.typing import NDArray
+from shapely import from_wkb, to_wkb
+from shapely.geometry.base import BaseGeometry
+
+from config import GEOMETRY_CACHE_DIR
+from utils import atomic_path
+
+# increase when the geometry assembly changes to invalidate old entries
+_VERSION = 3
+_KEY_SIZE = 16
+
+
+def geometry_cache_key(
+    outer_segments: Sequence[NDArray[np.floating]], inner_segments: Sequence[NDArray[np.floating]]
+) -> bytes:
+    h = blake2b(_VERSION.to_bytes(4, 'little'), digest_size=_KEY_SIZE)
+    for role, segments in ((b'outer', outer_segments), (b'inner', inner_segments)):
+        h.update(role)
+        h.update(len(segments).to_bytes(8, 'little'))
+        for segment in segments:
+            coords = np.asarray(segment, dtype=np.float64)
+            h.update(len(coords).to_bytes(8, 'little'))
+            h.update(coords.tobytes())
+    return h.digest()
+
+
+def load_geometry(relation_id: int, key: bytes) -> BaseGeometry | None:
+    path = GEOMETRY_CACHE_DIR / f'{relation_id}.wkb'
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    if data[:_KEY_SIZE] != key:
+        return None
+    return from_wkb(data[_KEY_SIZE:])
+
+
+def save_geometry(relation_id: int, key: bytes, geom: BaseGeometry) -> None:
+    GEOMETRY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = GEOMETRY_CACHE_DIR / f'{relation_id}.wkb'
+    with atomic_path(path) as temp_path:
+        temp_path.write_bytes(key + to_wkb(geom))
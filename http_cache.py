@@ -0,0 +1,143 @@
+import asyncio
+import json
+from collections.abc import AsyncIterable, AsyncIterator, Collection, Mapping
+from hashlib import sha256
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+from urllib.parse import urlencode
+
+from config import HTTP_CACHE_DIR
+from utils import atomic_path, replace_path
+
+_INDEX_DIR = HTTP_CACHE_DIR / 'index'
+_OBJECTS_DIR = HTTP_CACHE_DIR / 'objects'
+_CHUNK_SIZE = 1024 * 1024
+
+
+class CacheEntry(NamedTuple):
+    url: str
+    object: str  # sha256 of the response body
+    etag: str | None
+    last_modified: str | None
+
+
+def request_key(method: str, url: str, data: Mapping[str, str] | None = None) -> str:
+    h = sha256(f'{method} {url}'.encode())
+    if data:
+        h.update(b'\n')
+        h.update(urlencode(sorted(data.items())).encode())
+    return h.hexdigest()
+
+
+def load_entry(key: str) -> CacheEntry | None:
+    try:
+        entry = CacheEntry(**json.loads((_INDEX_DIR / f'{key}.json').read_bytes()))
+    except FileNotFoundError:
+        return None
+    if not (_OBJECTS_DIR / entry.object).is_file():
+        return None
+    return entry
+
+
+def conditional_headers(entry: CacheEntry | None) -> dict[str, str]:
+    headers = {}
+    if entry is not None:
+        if entry.etag is not None:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified is not None:
+            headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+
+def read_object(entry: CacheEntry) -> bytes:
+    return (_OBJECTS_DIR / entry.object).read_bytes()
+
+
+async def iter_object(entry: CacheEntry) -> AsyncIterator[bytes]:
+    f = _open_object(entry)
+    try:
+        while chunk := await asyncio.to_thread(f.read, _CHUNK_SIZE):
+            yield chunk
+    finally:
+        f.close()
+
+
+def save_response(key: str, url: str, content: bytes, headers: Mapping[str, str]) -> None:
+    h = sha256(content)
+    _OBJECTS_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = _OBJECTS_DIR / f'{key}.tmp'
+    temp_path.write_bytes(content)
+    _commit(key, url, temp_path, h.hexdigest(), headers)
+
+
+class ResponseRecording:
+    # passes a streamed response through into a temporary object,
+    # committed only once the caller has checked the response
+    __slots__ = ('_digest', '_key', '_temp_path')
+
+    def __init__(self, key: str):
+        self._key = key
+        self._temp_path = _OBJECTS_DIR / f'{key}.tmp'
+        self._digest: str | None = None
+
+    async def record(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        h = sha256()
+        _OBJECTS_DIR.mkdir(parents=True, exist_ok=True)
+        f = _open_temp(self._temp_path)
+        try:
+            async for chunk in chunks:
+                h.update(chunk)
+                f.write(chunk)
+                yield chunk
+        finally:
+            f.close()
+        self._digest = h.hexdigest()
+
+    def commit(self, url: str, headers: Mapping[str, str]) -> None:
+        if self._digest is None:
+            raise ValueError('Response was not fully recorded')
+        _commit(self._key, url, self._temp_path, self._digest, headers)
+
+    def discard(self) -> None:
+        self._temp_path.unlink(missing_ok=True)
+
+
+def drop_entries(url: str, keep: Collection[str]) -> None:
+    # remove the entries of url other than keep, and the objects only they referenced
+    if not _INDEX_DIR.is_dir():
+        return
+    for path in _INDEX_DIR.glob('*.json'):
+        if path.stem not in keep and json.loads(path.read_bytes())['url'] == url:
+            path.unlink()
+    _prune()
+
+
+def _open_object(entry: CacheEntry) -> BinaryIO:
+    return (_OBJECTS_DIR / entry.object).open('rb')
+
+
+def _open_temp(path: Path) -> BinaryIO:
+    return path.open('wb')
+
+
+def _commit(key: str, url: str, temp_path: Path, digest: str, headers: Mapping[str, str]) -> None:
+    replace_path(temp_path, _OBJECTS_DIR / digest)
+    entry = CacheEntry(
+        url=url,
+        object=digest,
+        etag=headers.get('ETag'),
+        last_modified=headers.get('Last-Modified'),
+    )
+    _INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    index_path = _INDEX_DIR / f'{key}.json'
+    with atomic_path(index_path) as index_temp_path:
+        index_temp_path.write_text(json.dumps(entry._asdict()))
+    _prune()
+
+
+def _prune() -> None:
+    # remove objects no longer referenced by any entry
+    referenced = {json.loads(path.read_bytes())['object'] for path in _INDEX_DIR.glob('*.json')}
+    for path in _OBJECTS_DIR.iterdir():
+        if path.name not in referenced and path.suffix != '.tmp':
+            path.unlink()
@@ -0,0 +1,107 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+
+from config import PROFILE_DIR, PROFILE_STAGES, VERSION
+from utils import atomic_path
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+
+class StageRecord:
+    __slots__ = ('calls', 'children_peak_rss', 'cpu', 'items', 'name', 'peak_rss', 'peak_rss_growth', 'wall')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.items = 0
+        # ru_maxrss is the peak over the whole process lifetime, not of the stage alone:
+        # peak_rss is that peak when the stage last ended, peak_rss_growth is how much the stage raised it
+        self.peak_rss = 0
+        self.peak_rss_growth = 0
+        self.children_peak_rss = 0
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+_started_at = time.time()
+_started_wall = time.perf_counter()
+_records: dict[str, StageRecord] = {}
+_profiles: dict[str, cProfile.Profile] = {}
+_profiling = False
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageRecord]:
+    # entering the same stage again accumulates into the same record,
+    # cpu time is process-wide, including background threads and finished child processes
+    global _profiling
+    record = _records.get(name)
+    if record is None:
+        record = _records[name] = StageRecord(name)
+
+    profile = None
+    if not _profiling and any(fnmatch(name, pattern) for pattern in PROFILE_STAGES):
+        profile = _profiles.get(name)
+        if profile is None:
+            profile = _profiles[name] = cProfile.Profile()
+        _profiling = True
+        profile.enable()
+
+    wall = time.perf_counter()
+    cpu = _cpu_time()
+    peak_rss = _peak_rss(resource.RUSAGE_SELF)
+    try:
+        yield record
+    finally:
+        record.wall += time.perf_counter() - wall
+        record.cpu += _cpu_time() - cpu
+        record.calls += 1
+        record.peak_rss = _peak_rss(resource.RUSAGE_SELF)
+        record.peak_rss_growth += record.peak_rss - peak_rss
+        record.children_peak_rss = _peak_rss(resource.RUSAGE_CHILDREN)
+
+        if profile is not None:
+            profile.disable()
+            _profiling = False
+
+
+def write_report(path: Path, **extra) -> None:
+    # also writes the profiles, accumulated over all entries of each stage
+    report = {
+        'version': VERSION,
+        'started_at': _started_at,
+        'wall': time.perf_counter() - _started_wall,
+        'cpu': _cpu_time(),
+        'peak_rss': _peak_rss(resource.RUSAGE_SELF),
+        'children_peak_rss': _peak_rss(resource.RUSAGE_CHILDREN),
+        **extra,
+        'stages': [record.to_dict() for record in _records.values()],
+    }
+    with atomic_path(path) as temp_path:
+        temp_path.write_text(json.dumps(report, indent=2) + '\n')
+
+    if _profiles:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        for name, profile in _profiles.items():
+            profile.dump_stats(PROFILE_DIR / f'{name}.prof')
+
+
+def _peak_rss(who: int) -> int:
+    return resource.getrusage(who).ru_maxrss * _RSS_SCALE
+
+
+def _cpu_time() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
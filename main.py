@@ -1,54 +1,36 @@
 import asyncio
-import json
-from decimal import Decimal
 
-from shapely.geometry import mapping
-from tqdm import tqdm
-
-from config import GEOJSON_DIR, GEOJSON_QUALITIES
+from config import GEOJSON_DIR, GEOJSON_QUALITIES, TOPOLOGY_SNAPSHOT, TOPOLOGY_SNAPSHOT_DIR
+from instrument import stage, write_report
 from natural_earth import validate_countries
 from osm_countries_gen import get_osm_countries
+from outputs import write_outputs
+from snapshot import save_snapshot
 
 
 async def main():
     # ensure output directory exists
     GEOJSON_DIR.mkdir(exist_ok=True)
-
-    countries, data_timestamp = await get_osm_countries()
-
-    await validate_countries(countries)
-
-    for q in tqdm(GEOJSON_QUALITIES, desc='Writing GeoJSON'):
-        q_str = f'{Decimal(str(q)):f}'.replace('.', '-')
-        path = GEOJSON_DIR / f'osm-countries-{q_str}.geojson'
-
-        features = tuple(
-            {
-                'type': 'Feature',
-                'properties': {
-                    'tags': country.tags,
-                    'timestamp': data_timestamp,
-                    'representative_point': country.representative_point,
-                },
-                'geometry': mapping(country.geometry[q]),
-            }
-            for country in countries
-        )
-
-        data = {
-            'type': 'FeatureCollection',
-            'name': path.stem,
-            'crs': {
-                'type': 'name',
-                'properties': {
-                    'name': 'urn:ogc:def:crs:OGC:1.3:CRS84',
-                },
-            },
-            'features': features,
-        }
-
-        buffer = json.dumps(data, ensure_ascii=False, check_circular=False, allow_nan=False)
-        path.write_text(buffer)
+    report_path = GEOJSON_DIR / 'run-report.json'
+
+    try:
+        countries, data_timestamp, topo = await get_osm_countries()
+
+        with stage('validate') as s:
+            await validate_countries(countries)
+            s.items += len(countries)
+
+        # only validated data is snapshotted
+        if TOPOLOGY_SNAPSHOT:
+            with stage('snapshot.save') as s:
+                save_snapshot(TOPOLOGY_SNAPSHOT_DIR, countries, data_timestamp, topo)
+                s.items += len(countries)
+
+        write_outputs(countries, data_timestamp, topo, GEOJSON_QUALITIES)
+    except BaseException as e:
+        write_report(report_path, error=repr(e))
+        raise
+    write_report(report_path, data_timestamp=data_timestamp)
 
 
 if __name__ == '__main__':
@@ -1,24 +1,41 @@
+import json
 from collections.abc import Sequence
 from datetime import timedelta
 
-from shapely import unary_union
+from shapely import STRtree, point_on_surface
 from shapely.geometry import shape
-from shapely.geometry.base import BaseGeometry
-from tqdm import tqdm
 
-from config import BEST_GEOJSON_QUALITY, COUNTRIES_GEOJSON_URL
+from config import BEST_GEOJSON_QUALITY, COUNTRIES_GEOJSON_URL, HTTP_CACHE_MODE
+from http_cache import CacheEntry, conditional_headers, load_entry, read_object, request_key, save_response
 from osm_countries_gen import OSMCountry
 from utils import HTTP, retry_exponential
 
 
-@retry_exponential(timedelta(minutes=30))
 async def _get_countries() -> Sequence[dict]:
-    r = await HTTP.get(COUNTRIES_GEOJSON_URL)
+    key = request_key('GET', COUNTRIES_GEOJSON_URL)
+    entry = load_entry(key)
+
+    if HTTP_CACHE_MODE == 'replay':
+        if entry is None:
+            raise Exception('No recorded Natural Earth response')
+        return json.loads(read_object(entry))['features']
+
+    return await _fetch(key, entry)
+
+
+@retry_exponential(timedelta(minutes=30))
+async def _fetch(key: str, entry: CacheEntry | None) -> Sequence[dict]:
+    r = await HTTP.get(COUNTRIES_GEOJSON_URL, headers=conditional_headers(entry))
+    if r.status_code == 304 and entry is not None:
+        return json.loads(read_object(entry))['features']
+
     r.raise_for_status()
-    return r.json()['features']
+    features = r.json()['features']
+    save_response(key, COUNTRIES_GEOJSON_URL, r.content, r.headers)
+    return features
 
 
-async def validate_countries(countries: Sequence[OSMCountry]) -> None:
+async def validate_countries(countries: Sequence[OSMCountry]) -> list[list[int]]:
     ne_countries = await _get_countries()
     ne_countries = tuple(
         c
@@ -33,12 +50,49 @@ async def validate_countries(countries: Sequence[OSMCountry]) -> None:
         )
     )
 
-    geometry_union: BaseGeometry = unary_union([c.geometry[BEST_GEOJSON_QUALITY] for c in countries])
+    # find the OSM countries containing the representative point of each Natural Earth country
+    tree = STRtree([c.geometry[BEST_GEOJSON_QUALITY] for c in countries])
+    ne_points = point_on_surface([shape(c['geometry']) for c in ne_countries])
+    ne_indices, osm_indices = tree.query(ne_points, predicate='within')
+    matches: list[list[int]] = [[] for _ in ne_countries]
+    for ne_idx, osm_idx in zip(ne_indices.tolist(), osm_indices.tolist(), strict=True):
+        matches[ne_idx].append(osm_idx)
+
+    # validate country geometries by checking if the representative point is inside the geometry,
+    # and that no country geometry spans multiple Natural Earth countries
+    claimed: dict[int, str] = {}
+    for ne_country, ne_matches in zip(ne_countries, matches, strict=True):
+        ne_name = ne_country['properties']['NAME']
+        if not ne_matches:
+            raise ValueError(f'Country geometry not found: {ne_name!r}')
+
+        ne_code = _get_country_code(ne_country)
+        if ne_code is None:
+            continue
+
+        # untagged matches (e.g. disputed areas) are reported by name
+        osm_codes = [countries[i].tags.get('ISO3166-1') for i in ne_matches]
+        if ne_code not in osm_codes:
+            osm_labels = (
+                code if code is not None else f'untagged {countries[i].tags.get("name", "??")!r}'
+                for i, code in zip(ne_matches, osm_codes, strict=True)
+            )
+            print(f'⚠️ Country {ne_name!r} ({ne_code}) matched {", ".join(osm_labels)}')
+
+        for i in ne_matches:
+            if countries[i].tags.get('boundary') == 'disputed':
+                continue
+            if (other_name := claimed.setdefault(i, ne_name)) != ne_name:
+                osm_name = countries[i].tags.get('name', '??')
+                raise ValueError(f'Country geometry {osm_name!r} covers both {other_name!r} and {ne_name!r}')
+
+    return matches
 
-    # validate country geometries by checking if the representative point is inside the geometry
-    for ne_country in tqdm(ne_countries, desc='Validating'):
-        ne_geom = shape(ne_country['geometry'])
-        ne_point = ne_geom.representative_point()
 
-        if not geometry_union.contains(ne_point):
-            raise ValueError(f'Country geometry not found: {ne_country["properties"]["NAME"]!r}')
+def _get_country_code(ne_country: dict) -> str | None:
+    properties = ne_country['properties']
+    for key in ('ISO_A2_EH', 'ISO_A2'):
+        code = properties.get(key)
+        if code is not None and len(code) == 2 and code.isalpha():
+            return code
+    return None
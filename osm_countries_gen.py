@@ -1,19 +1,35 @@
 from collections import defaultdict
-from collections.abc import Sequence
-from itertools import chain, cycle, islice, pairwise
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain, islice, pairwise
+from math import atan2
+from multiprocessing import get_context
+from string import ascii_uppercase
 from typing import NamedTuple
 
-import networkx as nx
 import numpy as np
-from shapely import Polygon
+from numpy.typing import NDArray
+from shapely import MultiPolygon, Polygon, is_valid, make_valid, orient_polygons
 from shapely.geometry import mapping
 from shapely.geometry.base import BaseGeometry
-from shapely.ops import orient, unary_union
+from shapely.ops import unary_union
 from tqdm import tqdm
 
-from config import BEST_GEOJSON_QUALITY, GEOJSON_QUALITIES
-from overpass import query_overpass
-from toposimplify import Topology
+from config import (
+    ASSEMBLY_WORKERS,
+    BEST_GEOJSON_QUALITY,
+    GEOJSON_QUALITIES,
+    GEOMETRY_CACHE,
+    OVERPASS_CONCURRENCY,
+    OVERPASS_SHARDS,
+    SHARED_WAYS,
+    SIMPLIFY_WORKERS,
+)
+from geometry_cache import geometry_cache_key, load_geometry, save_geometry
+from instrument import stage
+from overpass import query_overpass_sharded
+from toposimplify import SharedTopology, Topology
+from way_store import WayStore
 
 
 class OSMCountry(NamedTuple):
@@ -22,163 +38,352 @@ class OSMCountry(NamedTuple):
     representative_point: dict
 
 
-_QUERY = (
-    '('
-    'rel[boundary~"^(administrative|disputed)$"][admin_level=2]["ISO3166-1"][name];'
-    'rel(1703814);'  # Palestinian Territories
-    ');'
-    'out geom qt;'
-)
+_QUERY_COUNTRIES = 'rel[boundary~"^(administrative|disputed)$"][admin_level=2]["ISO3166-1"]{}[name];'
+_QUERY_EXTRA = 'rel(1703814);'  # Palestinian Territories
+_QUERY_OUT = 'out geom qt;'
+_QUERY_OUT_SHARED_WAYS = 'out body qt;way(r);out skel geom qt;'
 
+_QUERY = f'({_QUERY_COUNTRIES.format("")}{_QUERY_EXTRA});{_QUERY_OUT}'
+_QUERY_SHARED_WAYS = f'({_QUERY_COUNTRIES.format("")}{_QUERY_EXTRA});{_QUERY_OUT_SHARED_WAYS}'
 
-def _connect_segments(segments: Sequence[tuple[tuple]]) -> set[Sequence[tuple]]:
-    # count occurrences of each node
-    node_count = defaultdict(int)
-    for node in chain.from_iterable(segments):
-        node_count[node] += 1
 
-    # validate that all segments are closed (i.e., start and end at intersections)
-    for s in segments:
-        node_id_start = s[0]
-        node_id_end = s[-1]
-        if node_count[node_id_start] < 2 or node_count[node_id_end] < 2:
-            raise ValueError(f'Segments must be closed (node/{node_id_start}, node/{node_id_end})')
+def _shard_queries(shards: int, out: str) -> list[str]:
+    # split the countries by the first letter of the ISO3166-1 code, other codes go to the first shard
+    shards = min(shards, len(ascii_uppercase))
+    bounds = [len(ascii_uppercase) * i // shards for i in range(shards + 1)]
+    queries: list[str] = []
+    for start, stop in pairwise(bounds):
+        letters = f'{ascii_uppercase[start]}-{ascii_uppercase[stop - 1]}'
+        statements = _QUERY_COUNTRIES.format(f'["ISO3166-1"~"^[{letters}]"]')
+        if start == 0:
+            statements += _QUERY_COUNTRIES.format('["ISO3166-1"!~"^[A-Z]"]') + _QUERY_EXTRA
+        queries.append(f'({statements});{out}')
+    return queries
 
-    # node = intersection, node_count > 1
-    # edge = segment between intersections
-    graph = nx.DiGraph()
 
-    # build the graph
+def _connect_segments(segments: Sequence[tuple[tuple, ...]]) -> set[Sequence[tuple]]:
+    node_count = _count_nodes(segments)
+
+    # node = intersection, node_count > 1
+    # edge = path between intersections, traversed in both directions (half-edges)
+    edges_paths: set[tuple] = set()
     for segment in segments:
-        subsegment_start = None
-        subsegment = []
-        for node in segment:
-            # intersection node
+        path_start_idx = None
+        for i, node in enumerate(segment):
             if node_count[node] > 1:
-                if subsegment_start:
-                    if len(subsegment) == 0:
-                        graph.add_edge(subsegment_start, node)
-                        graph.add_edge(node, subsegment_start)
-                    elif len(subsegment) == 1:
-                        first = subsegment[0]
-                        graph.add_edge(subsegment_start, first)
-                        graph.add_edge(first, node)
-                        graph.add_edge(node, first)
-                        graph.add_edge(first, subsegment_start)
-                    else:
-                        first = subsegment[0]
-                        last = subsegment[-1]
-                        graph.add_edge(subsegment_start, first)
-                        graph.add_edge(first, last, subsegment=subsegment)
-                        graph.add_edge(last, node)
-                        graph.add_edge(node, last)
-                        graph.add_edge(last, first, subsegment=subsegment[::-1])
-                        graph.add_edge(first, subsegment_start)
-                subsegment = []
-                subsegment_start = node
-            # normal node
-            elif subsegment_start:
-                subsegment.append(node)
+                if path_start_idx is not None and (i - path_start_idx > 1 or node != segment[path_start_idx]):
+                    path = segment[path_start_idx : i + 1]
+                    edges_paths.add(min(path, path[::-1]))  # skip duplicate paths
+                path_start_idx = i
+
+    # sort the outgoing half-edges of each intersection by angle
+    half_edges_paths: list[tuple] = []
+    node_half_edges: defaultdict[tuple, list[tuple[float, int]]] = defaultdict(list)
+    for path in edges_paths:
+        for half_edge_path in (path, path[::-1]):
+            (x1, y1), (x2, y2) = half_edge_path[:2]
+            node_half_edges[half_edge_path[0]].append((atan2(y2 - y1, x2 - x1), len(half_edges_paths)))
+            half_edges_paths.append(half_edge_path)
+    del edges_paths
+
+    # half-edge index -> next half-edge index around the same face
+    half_edges_next = [0] * len(half_edges_paths)
+    for half_edges in node_half_edges.values():
+        half_edges.sort()
+        for (_, prev_half_edge), (_, half_edge) in pairwise((half_edges[-1], *half_edges)):
+            # arriving through the twin of half_edge, leave through the next clockwise half-edge
+            half_edges_next[half_edge ^ 1] = prev_half_edge
+    del node_half_edges
 
     # set to store connected segments (closed loops)
     connected = set()
 
-    # function to normalize a closed loop
-    def connected_normalize(segment: list) -> tuple:
-        min_idx = np.argmin(segment, axis=0)[0]
+    # trace the faces of the planar graph, every half-edge belongs to exactly one face
+    visited = [False] * len(half_edges_paths)
+    for first_half_edge in range(len(half_edges_paths)):
+        if visited[first_half_edge]:
+            continue
 
-        # normalize starting point
-        aligned = tuple(
-            chain(
-                islice(segment, min_idx, len(segment) - 1),
-                islice(segment, min_idx + 1),
-            )
-        )
+        face = [half_edges_paths[first_half_edge][0]]
+        half_edge = first_half_edge
+        while not visited[half_edge]:
+            visited[half_edge] = True
+            face.extend(islice(half_edges_paths[half_edge], 1, None))
+            half_edge = half_edges_next[half_edge]
 
-        # normalize orientation
-        if segment[-1] < segment[1]:
-            aligned = aligned[::-1]
+        # split the face at repeated intersections into simple loops
+        for ring in _split_ring(face):
+            if len(ring) >= 4 and ring[1] != ring[-2]:
+                connected.add(_normalize_ring(ring))
 
-        return aligned
+    return connected
 
-    for c in nx.simple_cycles(graph):
-        c = tuple(islice(cycle(c), len(c) + 1))  # close the cycle
 
-        merged_unordered: list[list] = []
+def _split_ring(ring: list[tuple]) -> list[list[tuple]]:
+    result: list[list[tuple]] = []
+    stack: list[tuple] = []
+    stack_indices: dict[tuple, int] = {}
+    for node in ring:
+        if (idx := stack_indices.get(node)) is not None:
+            loop = stack[idx:]
+            loop.append(node)
+            result.append(loop)
+            for removed in islice(stack, idx + 1, None):
+                del stack_indices[removed]
+            del stack[idx + 1 :]
+        else:
+            stack_indices[node] = len(stack)
+            stack.append(node)
+    return result
 
-        for u, v in pairwise(c):
-            if subsegment := graph[u][v].get('subsegment'):
-                merged_unordered.append(subsegment)
-            else:
-                merged_unordered.append([u, v])
 
-        if len(merged_unordered) < 2:
-            # this realistically will mean broken data: a single node, a small loop, etc.
-            print(f'⚠️ Single-segment cycle: {c!r}')
-            continue
+def _normalize_ring(segment: list) -> tuple:
+    min_idx = min(range(len(segment) - 1), key=segment.__getitem__)
 
-        first = merged_unordered[0]
-        second = merged_unordered[1]
+    # normalize starting point
+    aligned = tuple(
+        chain(
+            islice(segment, min_idx, len(segment) - 1),
+            islice(segment, min_idx + 1),
+        )
+    )
 
-        # proper orientation of the first segment
-        if first[0] in (second[0], second[-1]):  # noqa: SIM108
-            merged = first[::-1]
-        else:
-            merged = first
-
-        for segment in merged_unordered[1:]:
-            if merged[-1] == segment[0]:
-                merged.extend(islice(segment, 1, None))
-            elif merged[-1] == segment[-1]:
-                merged.extend(islice(reversed(segment), 1, None))
-            else:
-                print('⚠️ Invalid cycle')
-                break
-        else:
-            if len(merged) >= 4 and merged[1] != merged[-2]:
-                connected.add(connected_normalize(merged))
+    # normalize orientation
+    if aligned[-2] < aligned[1]:
+        aligned = aligned[::-1]
 
-    return connected
+    return aligned
 
 
-async def get_osm_countries() -> tuple[Sequence[OSMCountry], float]:
-    print('Querying Overpass API')
-    countries, data_timestamp = await query_overpass(_QUERY, http_timeout=300, must_return=True)
-    countries_geoms: list[BaseGeometry] = []
-    countries_geoms_q: list[dict[float, BaseGeometry]] = []
+def _count_nodes(segments: Sequence[tuple[tuple, ...]]) -> defaultdict[tuple, int]:
+    # count occurrences of each node
+    node_count = defaultdict(int)
+    for node in chain.from_iterable(segments):
+        node_count[node] += 1
+
+    # validate that all segments are closed (i.e., start and end at intersections)
+    for s in segments:
+        node_id_start = s[0]
+        node_id_end = s[-1]
+        if node_count[node_id_start] < 2 or node_count[node_id_end] < 2:
+            raise ValueError(f'Segments must be closed (node/{node_id_start}, node/{node_id_end})')
+
+    return node_count
+
+
+def _load_shared_ways(elements: Sequence[dict]) -> tuple[list[dict], WayStore]:
+    countries = [e for e in elements if e['type'] == 'relation']
+    way_store = WayStore(e for e in elements if e['type'] == 'way')
 
-    for country in tqdm(countries, desc='Processing geometry'):
-        outer_segments = []
-        inner_segments = []
+    # attach member geometries, as views into the way store
+    for country in countries:
         for member in country.get('members', []):
             if member['type'] != 'way':
                 continue
-            if member['role'] == 'outer':
-                outer_segments.append(tuple((g['lon'], g['lat']) for g in member['geometry']))
-            elif member['role'] == 'inner':
-                inner_segments.append(tuple((g['lon'], g['lat']) for g in member['geometry']))
-
-        try:
-            outer_simple = tuple(p for p in (Polygon(s) for s in _connect_segments(outer_segments)) if p.is_valid)
-            inner_simple = tuple(p for p in (Polygon(s) for s in _connect_segments(inner_segments)) if p.is_valid)
-            if not outer_simple:
-                raise Exception('No outer polygons')
-
-            outer_union: BaseGeometry = unary_union(outer_simple)
-            inner_union: BaseGeometry = unary_union(inner_simple)
-            countries_geoms.append(outer_union.difference(inner_union))
-            countries_geoms_q.append({})
-
-        except Exception as e:
-            country_name = country['tags'].get('name', '??')
-            raise Exception(f'Error processing {country_name}') from e
-
-    topo = Topology(countries_geoms)  # pyright: ignore[reportArgumentType]
-    del countries_geoms
-    for q in tqdm(sorted(GEOJSON_QUALITIES), desc='Simplifying geometry'):
-        for country_geoms_q, geom in zip(countries_geoms_q, topo.simplify(q), strict=True):
-            country_geoms_q[q] = orient(geom.buffer(0))  # fix geometry
-    del topo
+            if member['ref'] not in way_store:
+                country_name = country['tags'].get('name', '??')
+                raise Exception(f'Error processing {country_name}: missing way/{member["ref"]}')
+            member['geometry'] = way_store.coords(member['ref'])
+
+    return countries, way_store
+
+
+def _get_segments(country: dict) -> tuple[list[NDArray[np.floating]], list[NDArray[np.floating]]]:
+    outer_segments = []
+    inner_segments = []
+    for member in country.get('members', []):
+        if member['type'] != 'way':
+            continue
+        if member['role'] == 'outer':
+            outer_segments.append(member['geometry'])
+        elif member['role'] == 'inner':
+            inner_segments.append(member['geometry'])
+    return outer_segments, inner_segments
+
+
+def _assemble_geometry(
+    outer_segments: Sequence[NDArray[np.floating]], inner_segments: Sequence[NDArray[np.floating]]
+) -> BaseGeometry:
+    outer_rings = _connect_segments([tuple(map(tuple, s.tolist())) for s in outer_segments])
+    inner_rings = _connect_segments([tuple(map(tuple, s.tolist())) for s in inner_segments])
+    outer_simple = tuple(p for p in (Polygon(s) for s in outer_rings) if p.is_valid)
+    inner_simple = tuple(p for p in (Polygon(s) for s in inner_rings) if p.is_valid)
+    if not outer_simple:
+        raise Exception('No outer polygons')
+
+    outer_union: BaseGeometry = unary_union(outer_simple)
+    inner_union: BaseGeometry = unary_union(inner_simple)
+    return outer_union.difference(inner_union)
+
+
+def _assemble_geometries(
+    countries: Sequence[dict],
+    countries_segments: Sequence[tuple[list[NDArray[np.floating]], list[NDArray[np.floating]]]],
+    indices: Sequence[int],
+) -> Iterator[tuple[int, BaseGeometry]]:
+    # yield (index, geometry) pairs, in any order when running in parallel
+    if ASSEMBLY_WORKERS <= 1:
+        for i in tqdm(indices, desc='Processing geometry'):
+            try:
+                yield i, _assemble_geometry(*countries_segments[i])
+            except Exception as e:
+                raise Exception(f'Error processing {countries[i]["tags"].get("name", "??")}') from e
+        return
+
+    # schedule the largest countries first to avoid stragglers
+    indices = sorted(
+        indices,
+        key=lambda i: sum(len(s) for segments in countries_segments[i] for s in segments),
+        reverse=True,
+    )
+
+    with ProcessPoolExecutor(ASSEMBLY_WORKERS, mp_context=get_context('spawn')) as executor:
+        futures = {executor.submit(_assemble_geometry, *countries_segments[i]): i for i in indices}
+        for future in tqdm(as_completed(futures), desc='Processing geometry', total=len(futures)):
+            i = futures[future]
+            try:
+                yield i, future.result()
+            except Exception as e:
+                for f in futures:
+                    f.cancel()
+                raise Exception(f'Error processing {countries[i]["tags"].get("name", "??")}') from e
+
+
+def _polygonal(geoms: Sequence[BaseGeometry | None]) -> list[Polygon | MultiPolygon]:
+    # all geometries are assembled by now, and the difference of polygons is always polygonal
+    result: list[Polygon | MultiPolygon] = []
+    for geom in geoms:
+        if not isinstance(geom, Polygon | MultiPolygon):
+            raise TypeError(f'Expected a polygonal geometry, got {type(geom).__name__}')
+        result.append(geom)
+    return result
+
+
+def _simplify(topo: Topology, q: float, start: int = 0, stop: int | None = None) -> tuple[list[BaseGeometry], int]:
+    # simplification may introduce self-intersections, only the invalid geometries are repaired
+    geoms = np.asarray(topo.simplify(q, start, stop), dtype=np.object_)
+    invalid = ~is_valid(geoms)
+    repaired = int(np.count_nonzero(invalid))
+    if repaired:
+        geoms[invalid] = make_valid(geoms[invalid], method='structure', keep_collapsed=False)
+    return orient_polygons(geoms).tolist(), repaired
+
+
+_worker_topo: Topology | None = None
+
+
+def _simplify_worker_init(shared: SharedTopology) -> None:
+    global _worker_topo
+    _worker_topo = Topology.attach(shared)
+
+
+def _simplify_worker(q: float, start: int, stop: int) -> tuple[list[BaseGeometry], int]:
+    return _simplify(_worker_topo, q, start, stop)  # pyright: ignore[reportArgumentType]
+
+
+def _simplify_parallel(
+    topo: Topology, countries_geoms_q: list[dict[float, BaseGeometry]], qualities: Sequence[float], workers: int
+) -> dict[float, int]:
+    # split each quality into chunks of similar size, best (slowest) quality first
+    chunks = topo.partition(workers * 4)
+    tasks = [(q, start, stop) for q in sorted(qualities) for start, stop in chunks]
+
+    with (
+        topo.share() as shared,
+        ProcessPoolExecutor(
+            workers,
+            mp_context=get_context('spawn'),
+            initializer=_simplify_worker_init,
+            initargs=(shared,),
+        ) as executor,
+    ):
+        results = executor.map(_simplify_worker, *zip(*tasks, strict=True))
+        repaired_q = dict.fromkeys(qualities, 0)
+        for (q, start, stop), (geoms, repaired) in zip(
+            tasks, tqdm(results, desc='Simplifying geometry', total=len(tasks)), strict=True
+        ):
+            for country_geoms_q, geom in zip(countries_geoms_q[start:stop], geoms, strict=True):
+                country_geoms_q[q] = geom
+            repaired_q[q] += repaired
+    return repaired_q
+
+
+def simplify_countries(topo: Topology, qualities: Sequence[float]) -> list[dict[float, BaseGeometry]]:
+    countries_geoms_q: list[dict[float, BaseGeometry]] = [{} for _ in range(len(topo))]
+    repaired_q: dict[float, int] = {}
+    if SIMPLIFY_WORKERS > 1:
+        # levels are processed together, and timed as a single stage
+        with stage('simplify') as s:
+            repaired_q = _simplify_parallel(topo, countries_geoms_q, qualities, SIMPLIFY_WORKERS)
+            s.items += len(countries_geoms_q) * len(qualities)
+    else:
+        for q in tqdm(sorted(qualities), desc='Simplifying geometry'):
+            with stage(f'simplify.{q}') as s:
+                geoms, repaired_q[q] = _simplify(topo, q)
+                for country_geoms_q, geom in zip(countries_geoms_q, geoms, strict=True):
+                    country_geoms_q[q] = geom
+                s.items += len(countries_geoms_q)
+
+    for q, repaired in sorted(repaired_q.items()):
+        print(f'Repaired {repaired} invalid geometries at quality {q}')
+    return countries_geoms_q
+
+
+async def get_osm_countries() -> tuple[Sequence[OSMCountry], float, Topology]:
+    print('Querying Overpass API')
+    if OVERPASS_SHARDS > 1:
+        queries = _shard_queries(OVERPASS_SHARDS, _QUERY_OUT_SHARED_WAYS if SHARED_WAYS else _QUERY_OUT)
+    else:
+        queries = (_QUERY_SHARED_WAYS if SHARED_WAYS else _QUERY,)
+    elements, data_timestamp = await query_overpass_sharded(
+        queries, http_timeout=300, must_return=True, concurrency=OVERPASS_CONCURRENCY
+    )
+
+    if SHARED_WAYS:
+        with stage('shared_ways') as s:
+            countries, way_store = _load_shared_ways(elements)
+            del elements
+            endpoints = way_store.junctions(countries)
+            s.items += len(way_store)
+    else:
+        countries = elements
+        way_store = None
+        endpoints = None
+
+    with stage('segments') as s:
+        countries_segments = [_get_segments(country) for country in countries]
+        s.items += len(countries)
+
+    countries_geoms: list[BaseGeometry | None]
+    if GEOMETRY_CACHE:
+        with stage('geometry_cache.load') as s:
+            cache_keys = [geometry_cache_key(*segments) for segments in countries_segments]
+            countries_geoms = [
+                load_geometry(country['id'], cache_key)
+                for country, cache_key in zip(countries, cache_keys, strict=True)
+            ]
+            s.items += sum(geom is not None for geom in countries_geoms)
+    else:
+        cache_keys = None
+        countries_geoms = [None] * len(countries)
+
+    misses = [i for i, geom in enumerate(countries_geoms) if geom is None]
+    if GEOMETRY_CACHE:
+        print(f'Geometry cache: {len(countries) - len(misses)} hits, {len(misses)} misses')
+
+    with stage('assemble') as s:
+        for i, geom in _assemble_geometries(countries, countries_segments, misses):
+            countries_geoms[i] = geom
+            if cache_keys is not None:
+                save_geometry(countries[i]['id'], cache_keys[i], geom)
+        s.items += len(misses)
+    del countries_segments
+
+    with stage('topology') as s:
+        topo = Topology(_polygonal(countries_geoms), endpoints)
+        s.items += len(countries_geoms)
+    del countries_geoms, way_store, endpoints
+    countries_geoms_q = simplify_countries(topo, GEOJSON_QUALITIES)
 
     result: list[OSMCountry] = []
     for country, country_geoms_q in zip(countries, countries_geoms_q, strict=True):
@@ -190,4 +395,4 @@ async def get_osm_countries() -> tuple[Sequence[OSMCountry], float]:
                 representative_point=mapping(point),
             )
         )
-    return result, data_timestamp
+    return result, data_timestamp, topo
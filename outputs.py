@@ -0,0 +1,94 @@
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from shapely import orient_polygons, set_precision
+from tqdm import tqdm
+
+from config import (
+    COUNTRY_SPLIT,
+    COUNTRY_SPLIT_DIR,
+    FLATGEOBUF,
+    GEOJSON_DIR,
+    GEOJSON_PRECISION,
+    OUTPUT_COMPRESSION,
+    TOPOJSON,
+    VECTOR_TILES,
+    VECTOR_TILES_MAX_ZOOM,
+)
+from country_split import write_country_split
+from flatgeobuf_writer import write_flatgeobuf
+from geojson_writer import write_geojson
+from instrument import stage
+from osm_countries_gen import OSMCountry
+from precompress import precompress
+from topojson_writer import write_topojson
+from toposimplify import Topology
+from utils import quality_suffix
+from vector_tiles import write_mbtiles, zoom_quality
+
+
+def write_outputs(
+    countries: Sequence[OSMCountry], data_timestamp: float, topo: Topology, qualities: Sequence[float]
+) -> None:
+    # countries must have geometry for all the qualities
+    GEOJSON_DIR.mkdir(exist_ok=True)
+
+    # compress the text outputs in the background, while the next quality is being written
+    with ThreadPoolExecutor() as executor:
+        futures: list[Future] = []
+        for q in tqdm(qualities, desc='Writing GeoJSON'):
+            q_str = quality_suffix(q)
+            path = GEOJSON_DIR / f'osm-countries-{q_str}.geojson'
+            precision = GEOJSON_PRECISION.get(q)
+            if precision is not None:
+                with stage(f'round.{q}') as s:
+                    round_geometries(countries, q, precision)
+                    s.items += len(countries)
+            with stage(f'write.geojson.{q}') as s:
+                write_geojson(path, countries, q, data_timestamp, precision=precision)
+                s.items += path.stat().st_size
+            compress_paths = [path]
+            if TOPOJSON:
+                topojson_path = path.with_suffix('.topojson')
+                with stage(f'write.topojson.{q}') as s:
+                    topology_arcs = topo.simplify_arcs(q)
+                    write_topojson(topojson_path, countries, topology_arcs, data_timestamp, precision=precision)
+                    s.items += topojson_path.stat().st_size
+                compress_paths.append(topojson_path)
+            if FLATGEOBUF:
+                fgb_path = path.with_suffix('.fgb')
+                with stage(f'write.flatgeobuf.{q}') as s:
+                    write_flatgeobuf(fgb_path, countries, q, data_timestamp, precision=precision)
+                    s.items += fgb_path.stat().st_size
+            if COUNTRY_SPLIT:
+                with stage(f'write.split.{q}') as s:
+                    split_paths = write_country_split(
+                        COUNTRY_SPLIT_DIR / q_str, countries, q, data_timestamp, precision=precision
+                    )
+                    s.items += len(split_paths)
+                compress_paths.extend(split_paths)
+            futures.extend(executor.submit(precompress, p, fmt) for p in compress_paths for fmt in OUTPUT_COMPRESSION)
+
+        if VECTOR_TILES:
+            tiles_qualities = {zoom_quality(zoom) for zoom in range(VECTOR_TILES_MAX_ZOOM + 1)}
+            if tiles_qualities.issubset(qualities):
+                mbtiles_path = GEOJSON_DIR / 'osm-countries.mbtiles'
+                with stage('write.mbtiles') as s:
+                    write_mbtiles(mbtiles_path, countries)
+                    s.items += mbtiles_path.stat().st_size
+            else:
+                print(f'Skipping vector tiles, they require qualities {sorted(tiles_qualities)}')
+
+        # only the remaining compression time, most of it overlaps with writing
+        with stage('compress') as s:
+            for future in tqdm(futures, desc='Compressing'):
+                s.items += future.result().stat().st_size
+
+
+def round_geometries(countries: Sequence[OSMCountry], q: float, precision: int) -> None:
+    # snap to the output grid before writing, GEOS repairs the rings the rounding would make invalid
+    geoms = np.asarray([country.geometry[q] for country in countries], dtype=np.object_)
+    geoms = orient_polygons(set_precision(geoms, 10.0**-precision))
+    for country, geom in zip(countries, geoms.tolist(), strict=True):
+        country.geometry[q] = geom
@@ -1,29 +1,213 @@
-from collections.abc import Sequence
+import asyncio
+import json
+import re
+from codecs import getincrementaldecoder
+from collections.abc import AsyncIterable, Sequence
 from datetime import UTC, datetime, timedelta
 
-from config import OVERPASS_API_INTERPRETER
+import numpy as np
+
+from config import HTTP_CACHE_MODE, OVERPASS_API_INTERPRETER
+from http_cache import ResponseRecording, drop_entries, iter_object, load_entry, request_key
+from instrument import stage
 from utils import HTTP, retry_exponential
 
+_ELEMENTS_RE = re.compile(r'"elements"\s*:\s*\[')
+_WHITESPACE_RE = re.compile(r'[\s,]*')
+_DECODER = json.JSONDecoder()
 
-@retry_exponential(timedelta(minutes=30))
-async def query_overpass(query: str, *, http_timeout: int, must_return: bool = True) -> tuple[Sequence[dict], float]:
-    join = '' if query.startswith('[') else ';'
-    query = f'[out:json][timeout:{http_timeout}]{join}{query}'
 
-    r = await HTTP.post(OVERPASS_API_INTERPRETER, data={'data': query}, timeout=http_timeout * 2)
-    r.raise_for_status()
+async def query_overpass_sharded(
+    queries: Sequence[str], *, http_timeout: int, must_return: bool = True, concurrency: int
+) -> tuple[Sequence[dict], float]:
+    # the first shard is fetched alone, the others are pinned to its database state with [date:...]
+    # and fetched concurrently, elements returned by several shards are merged
+    limit = asyncio.Semaphore(concurrency)
+
+    with stage('overpass.fetch') as s:
+        header, elements = await _query(queries[0], http_timeout, must_return, limit)
+        timestamp = header['osm3s']['timestamp_osm_base']
+
+        if len(queries) > 1:
+            async with asyncio.TaskGroup() as tg:
+                tasks = [
+                    tg.create_task(_query(query, http_timeout, must_return, limit, timestamp)) for query in queries[1:]
+                ]
+            seen: set[tuple[str, int]] = set()
+            shards_elements = (elements, *(task.result()[1] for task in tasks))
+            elements = []
+            for shard_elements in shards_elements:
+                for element in shard_elements:
+                    element_key = (element['type'], element['id'])
+                    if element_key not in seen:
+                        seen.add(element_key)
+                        elements.append(element)
+        s.items += len(elements)
+
+    if HTTP_CACHE_MODE == 'record':
+        # drop the recordings of shards no longer queried, e.g. after changing the number of shards
+        drop_entries(OVERPASS_API_INTERPRETER, {_cache_key(query, http_timeout) for query in queries})
 
-    data = r.json()
     data_timestamp = (
         datetime.strptime(
-            data['osm3s']['timestamp_osm_base'],
+            timestamp,
             '%Y-%m-%dT%H:%M:%SZ',
         )
         .replace(tzinfo=UTC)
         .timestamp()
     )
 
-    if must_return and not data['elements']:
-        raise Exception('No elements returned')
+    return elements, data_timestamp
+
+
+def _wrap_query(query: str, http_timeout: int, date: str | None = None) -> str:
+    join = '' if query.startswith('[') else ';'
+    settings = f'[out:json][timeout:{http_timeout}]'
+    if date is not None:
+        settings += f'[date:"{date}"]'
+    return f'{settings}{join}{query}'
+
+
+def _cache_key(query: str, http_timeout: int) -> str:
+    # the key leaves out the pinned date, a new recording of a shard replaces the previous one
+    return request_key('POST', OVERPASS_API_INTERPRETER, {'data': _wrap_query(query, http_timeout)})
+
+
+async def _query(
+    query: str, http_timeout: int, must_return: bool, limit: asyncio.Semaphore, date: str | None = None
+) -> tuple[dict, list[dict]]:
+    key = _cache_key(query, http_timeout)
+    if HTTP_CACHE_MODE == 'replay':
+        entry = load_entry(key)
+        if entry is None:
+            raise Exception('No recorded Overpass response for this query')
+        return await _parse_response(iter_object(entry))
+    return await _fetch(
+        _wrap_query(query, http_timeout, date),
+        key,
+        http_timeout=http_timeout,
+        must_return=must_return,
+        limit=limit,
+        min_timestamp=date,
+    )
+
+
+@retry_exponential(timedelta(minutes=30))
+async def _fetch(
+    query: str,
+    key: str,
+    *,
+    http_timeout: int,
+    must_return: bool,
+    limit: asyncio.Semaphore,
+    min_timestamp: str | None,
+) -> tuple[dict, list[dict]]:
+    recording = ResponseRecording(key) if HTTP_CACHE_MODE == 'record' else None
+    try:
+        # the concurrency limit is released while waiting to retry
+        async with (
+            limit,
+            HTTP.stream('POST', OVERPASS_API_INTERPRETER, data={'data': query}, timeout=http_timeout * 2) as r,
+        ):
+            r.raise_for_status()
+            chunks = r.aiter_bytes()
+            if recording is not None:
+                chunks = recording.record(chunks)
+            header, elements = await _parse_response(chunks)
+
+        # a server behind the pinned date is missing the latest changes, retry until one has caught up
+        timestamp = header['osm3s']['timestamp_osm_base']
+        if min_timestamp is not None and timestamp < min_timestamp:
+            raise Exception(f'Overpass database at {timestamp} is behind {min_timestamp}')
+
+        if must_return and not elements:
+            raise Exception('No elements returned')
+
+        # only a response that passed the checks is recorded
+        if recording is not None:
+            recording.commit(OVERPASS_API_INTERPRETER, r.headers)
+    finally:
+        if recording is not None:
+            recording.discard()
+
+    return header, elements
+
+
+async def _parse_response(chunks: AsyncIterable[bytes]) -> tuple[dict, list[dict]]:
+    # incrementally parse the response, decoding one element at a time:
+    # {"version": ..., "osm3s": {...}, "elements": [{...}, ...], "remark": ...}
+    decoder = getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    header: dict | None = None
+    elements: list[dict] = []
+    retry_size = 0  # don't retry decoding an incomplete element until enough data arrives
+
+    async for chunk in chunks:
+        # parsing time excludes waiting for the next chunk
+        with stage('overpass.parse'):
+            buffer += decoder.decode(chunk)
+
+            if header is None:
+                match = _ELEMENTS_RE.search(buffer)
+                if match is None:
+                    continue
+                header = json.loads(buffer[: match.start()].rstrip().rstrip(',') + '}')
+                pos = match.end()
+
+            if len(buffer) - pos < retry_size:
+                continue
+
+            while True:
+                pos = _WHITESPACE_RE.match(buffer, pos).end()  # pyright: ignore[reportOptionalMemberAccess]
+                if pos == len(buffer) or buffer[pos] == ']':
+                    break
+                try:
+                    element, pos = _DECODER.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    retry_size = (len(buffer) - pos) * 2
+                    break
+                elements.append(_compact_element(element))
+                retry_size = 0
+
+            # drop the already parsed data
+            if pos > len(buffer) // 2:
+                buffer = buffer[pos:]
+                pos = 0
+
+    with stage('overpass.parse') as s:
+        buffer += decoder.decode(b'', final=True)
+        if header is None:
+            raise ValueError('Invalid Overpass response: missing elements')
+
+        # parse the remaining elements and the trailer
+        while True:
+            pos = _WHITESPACE_RE.match(buffer, pos).end()  # pyright: ignore[reportOptionalMemberAccess]
+            if buffer[pos] == ']':
+                break
+            element, pos = _DECODER.raw_decode(buffer, pos)
+            elements.append(_compact_element(element))
+
+        trailer = buffer[pos + 1 :].strip()
+        trailer = json.loads('{' + trailer.removeprefix(',').lstrip()) if trailer != '}' else {}
+        s.items += len(elements)
+    if remark := trailer.get('remark'):
+        raise Exception(f'Overpass error: {remark}')
+
+    return header, elements
+
+
+def _compact_element(element: dict) -> dict:
+    # replace lists of {'lat', 'lon'} dicts with (n, 2) arrays of lon, lat
+    if (geometry := element.get('geometry')) is not None:
+        element['geometry'] = _compact_geometry(geometry)
+    if (nodes := element.get('nodes')) is not None:
+        element['nodes'] = np.array(nodes, dtype=np.int64)
+    for member in element.get('members', ()):
+        if (geometry := member.get('geometry')) is not None:
+            member['geometry'] = _compact_geometry(geometry)
+    return element
+
 
-    return data['elements'], data_timestamp
+def _compact_geometry(geometry: list[dict]) -> np.ndarray:
+    return np.array([(g['lon'], g['lat']) for g in geometry], dtype=np.float64).reshape(-1, 2)
@@ -0,0 +1,57 @@
+import gzip
+import os
+import shutil
+from collections.abc import Callable
+from pathlib import Path
+from typing import BinaryIO
+
+import brotli
+import zopfli.gzip
+import zstandard
+
+from config import OUTPUT_BROTLI_QUALITY, OUTPUT_ZOPFLI_ITERATIONS, OUTPUT_ZSTD_LEVEL
+from utils import atomic_path
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def precompress(path: Path, fmt: str) -> Path:
+    # write a compressed copy next to the file, for web servers serving pre-compressed files
+    compress = _COMPRESSORS.get(fmt)
+    if compress is None:
+        raise ValueError(f'Unsupported compression format: {fmt!r}')
+    result = path.with_name(f'{path.name}.{fmt}')
+    with atomic_path(result) as temp_path, path.open('rb') as src, temp_path.open('wb') as dst:
+        compress(src, dst)
+    return result
+
+
+def _compress_gzip(src: BinaryIO, dst: BinaryIO) -> None:
+    if OUTPUT_ZOPFLI_ITERATIONS > 0:
+        # zopfli compresses the whole input at once, and writes a zero mtime
+        dst.write(zopfli.gzip.compress(src.read(), numiterations=OUTPUT_ZOPFLI_ITERATIONS))
+        return
+
+    # zero mtime keeps the output reproducible
+    with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=9, mtime=0) as f:
+        shutil.copyfileobj(src, f, _CHUNK_SIZE)
+
+
+def _compress_brotli(src: BinaryIO, dst: BinaryIO) -> None:
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=OUTPUT_BROTLI_QUALITY, lgwin=24)
+    while chunk := src.read(_CHUNK_SIZE):
+        dst.write(compressor.process(chunk))
+    dst.write(compressor.finish())
+
+
+def _compress_zstd(src: BinaryIO, dst: BinaryIO) -> None:
+    # with the size known, the window is sized by the level and the input, like zstd --ultra -22 on a file
+    size = os.fstat(src.fileno()).st_size
+    zstandard.ZstdCompressor(level=OUTPUT_ZSTD_LEVEL).copy_stream(src, dst, size=size, read_size=_CHUNK_SIZE)
+
+
+_COMPRESSORS: dict[str, Callable[[BinaryIO, BinaryIO], None]] = {
+    'gz': _compress_gzip,
+    'br': _compress_brotli,
+    'zst': _compress_zstd,
+}
@@ -0,0 +1,35 @@
+import argparse
+
+from config import GEOJSON_DIR, GEOJSON_QUALITIES, TOPOLOGY_SNAPSHOT_DIR
+from instrument import stage, write_report
+from osm_countries_gen import simplify_countries
+from outputs import write_outputs
+from snapshot import load_snapshot
+
+
+def main() -> None:
+    # regenerate the outputs from the last topology snapshot, without network access
+    parser = argparse.ArgumentParser(description='Regenerate the outputs from the last topology snapshot')
+    parser.add_argument('qualities', nargs='*', type=float, help='qualities to write, all configured by default')
+    args = parser.parse_args()
+    qualities: tuple[float, ...] = tuple(args.qualities) or GEOJSON_QUALITIES
+    report_path = GEOJSON_DIR / 'resimplify-report.json'
+
+    try:
+        with stage('snapshot.load') as s:
+            countries, data_timestamp, topo = load_snapshot(TOPOLOGY_SNAPSHOT_DIR)
+            s.items += len(countries)
+
+        for country, country_geoms_q in zip(countries, simplify_countries(topo, qualities), strict=True):
+            country.geometry.update(country_geoms_q)
+
+        write_outputs(countries, data_timestamp, topo, qualities)
+    except BaseException as e:
+        GEOJSON_DIR.mkdir(exist_ok=True)
+        write_report(report_path, error=repr(e))
+        raise
+    write_report(report_path, data_timestamp=data_timestamp)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,23 +27,6 @@ let
     curl
     jq
 
-    findutils
-    zopfli
-    brotli
-    zstd
-
-    (writeShellScriptBin "compress-geojson" ''
-      set -e
-      echo "Compressing GeoJSON files..."
-      rm -f geojson/*.geojson.{gz,br,zst}
-      files=$(find geojson -type f -name '*.geojson')
-      for file in $files; do
-        zopfli "$file" &
-        brotli --best "$file" &
-        zstd --no-progress --ultra -22 --single-thread "$file" &
-      done
-      wait
-    '')
     (writeShellScriptBin "nixpkgs-update" ''
       set -e
       hash=$(
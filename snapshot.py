@@ -0,0 +1,39 @@
+import json
+from collections.abc import Sequence
+from pathlib import Path
+
+from osm_countries_gen import OSMCountry
+from toposimplify import Topology
+from utils import atomic_path
+
+# increase when the snapshot format changes to reject old snapshots
+_VERSION = 1
+
+
+def save_snapshot(path: Path, countries: Sequence[OSMCountry], data_timestamp: float, topo: Topology) -> None:
+    data = {
+        'version': _VERSION,
+        'data_timestamp': data_timestamp,
+        'countries': [
+            {'tags': country.tags, 'representative_point': country.representative_point} for country in countries
+        ],
+    }
+    # the directory is written aside and swapped in, readers never see a partial snapshot
+    with atomic_path(path) as temp_path:
+        topo.save(temp_path)
+        (temp_path / 'countries.json').write_text(json.dumps(data, ensure_ascii=False))
+
+
+def load_snapshot(path: Path) -> tuple[list[OSMCountry], float, Topology]:
+    # countries are returned without geometry, it is recreated by simplifying the topology
+    data = json.loads((path / 'countries.json').read_bytes())
+    if data['version'] != _VERSION:
+        raise ValueError(f'Unsupported snapshot version {data["version"]}, expected {_VERSION}')
+    topo = Topology.load(path)
+    countries = [
+        OSMCountry(tags=country['tags'], geometry={}, representative_point=country['representative_point'])
+        for country in data['countries']
+    ]
+    if len(countries) != len(topo):
+        raise ValueError(f'Snapshot has {len(countries)} countries, but {len(topo)} geometries')
+    return countries, data['data_timestamp'], topo
@@ -0,0 +1,85 @@
+import numpy as np
+from numpy.typing import NDArray
+from shapely import (
+    MultiPoint,
+    MultiPolygon,
+    Point,
+    Polygon,
+    box,
+    get_coordinates,
+    get_parts,
+    segmentize,
+    transform,
+    voronoi_polygons,
+)
+from shapely.geometry.base import BaseGeometry
+
+# reproducible country-like test data, shared by the benchmark, the fake Overpass API and the tests
+
+_EXTENT = (-40.0, -20.0, 40.0, 20.0)
+
+
+def synthetic_countries(
+    countries: int = 200,
+    *,
+    density: float = 200,
+    seed: int = 0,
+    enclaves: int = 10,
+    holes: int = 10,
+    islands: int = 20,
+) -> list[Polygon | MultiPolygon]:
+    # a reproducible mosaic of Voronoi cells with wiggly shared borders,
+    # density is the number of border vertices per degree
+    rng = np.random.default_rng(seed)
+    min_x, min_y, max_x, max_y = _EXTENT
+    extent = box(*_EXTENT)
+    seeds = np.column_stack((rng.uniform(min_x, max_x, countries), rng.uniform(min_y, max_y, countries)))
+    cells: list[BaseGeometry] = [
+        cell.intersection(extent) for cell in get_parts(voronoi_polygons(MultiPoint(seeds), extend_to=extent))
+    ]
+    special = rng.permutation(len(cells))
+
+    # enclaves are separate countries inside a hole of another country, other holes stay empty
+    for i, hole_idx in enumerate(special[: enclaves + holes].tolist()):
+        host = cells[hole_idx]
+        center = host.representative_point()
+        hole = center.buffer(host.exterior.distance(center) * 0.3, quad_segs=4)
+        cells[hole_idx] = host.difference(hole)
+        if i < enclaves:
+            cells.append(hole)
+
+    # islands are placed in the sea around the mosaic and attached to random countries
+    for island_idx in rng.integers(0, countries, islands).tolist():
+        x = rng.uniform(min_x, max_x)
+        y = rng.choice((min_y - 1, max_y + 1)) + rng.uniform(-0.5, 0.5)
+        island = Point(x, y).buffer(rng.uniform(0.05, 0.3), quad_segs=4)
+        cells[island_idx] = cells[island_idx].union(island)
+
+    # the displacement only depends on the coordinates, so shared borders stay shared
+    def displace(coords: NDArray[np.float64]) -> NDArray[np.float64]:
+        x = coords[:, 0]
+        y = coords[:, 1]
+        offset = np.column_stack((
+            0.05 * np.sin(x * 0.9 + y * 2.3) + 0.0015 * np.sin(x * 173.0 + y * 31.0),
+            0.05 * np.cos(x * 1.7 - y * 0.8) + 0.0015 * np.cos(x * 47.0 - y * 151.0),
+        ))
+        return (coords + offset).round(7)
+
+    result: list[Polygon | MultiPolygon] = []
+    for cell in cells:
+        geom = transform(segmentize(cell, 1 / density), displace)
+        if not isinstance(geom, Polygon | MultiPolygon):
+            raise TypeError(f'Expected a polygonal geometry, got {type(geom).__name__}')
+        result.append(geom)
+    return result
+
+
+def split_rings(geom: BaseGeometry, way_size: int) -> tuple[list[NDArray], list[NDArray]]:
+    # split rings into overlapping chunks, resembling the member ways of a relation
+    outer: list[NDArray] = []
+    inner: list[NDArray] = []
+    for poly in get_parts(geom):
+        for segments, ring in ((outer, poly.exterior), *((inner, interior) for interior in poly.interiors)):
+            coords = get_coordinates(ring)
+            segments.extend(coords[i : i + way_size + 1] for i in range(0, len(coords) - 1, way_size))
+    return outer, inner
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+from shapely import Polygon, box
+from shapely.geometry import mapping
+
+from country_split import write_country_split
+from osm_countries_gen import OSMCountry
+
+_Q = 0.1
+
+
+def _country(code: str, geom: Polygon) -> OSMCountry:
+    return OSMCountry(
+        tags={'ISO3166-1': code, 'name': code},
+        geometry={_Q: geom},
+        representative_point=mapping(geom.representative_point()),
+    )
+
+
+def _reject_constant(value: str):
+    raise ValueError(f'Invalid JSON constant {value}')
+
+
+@pytest.mark.parametrize('precision', [None, 3])
+def test_manifest_bbox(tmp_path, precision):
+    countries = [_country('AA', box(1.00011, 2, 3, 4.5)), _country('BB', Polygon()), _country('AA', box(5, 6, 7, 8))]
+    paths = write_country_split(tmp_path, countries, _Q, 1700000000.0, precision=precision)
+    assert [path.name for path in paths] == ['AA.geojson', 'BB.geojson', 'AA-2.geojson']
+
+    manifest = json.loads((tmp_path / 'manifest.json').read_text(), parse_constant=_reject_constant)
+    bboxes = [entry['bbox'] for entry in manifest['countries']]
+    assert bboxes == [[1.0 if precision == 3 else 1.00011, 2.0, 3.0, 4.5], None, [5.0, 6.0, 7.0, 8.0]]
+    assert [entry['file'] for entry in manifest['countries']] == [path.name for path in paths]
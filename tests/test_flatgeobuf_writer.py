@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+import pytest
+from pyogrio import list_layers, read_info
+from pyogrio.raw import read
+from shapely import box, equals_exact, from_wkb, get_parts, intersects, multipolygons
+from shapely.geometry import mapping
+
+from flatgeobuf_writer import write_flatgeobuf
+from osm_countries_gen import OSMCountry
+from synthetic import synthetic_countries
+
+_Q = 0.1
+
+
+def _countries(n: int) -> list[OSMCountry]:
+    # synthetic mosaics have extra enclave countries, only the first n are kept
+    return [
+        OSMCountry(
+            tags={'ISO3166-1': f'C{i}', 'name': f'País «{i}»'},
+            geometry={_Q: geom},
+            representative_point=mapping(geom.representative_point()),
+        )
+        for i, geom in enumerate(synthetic_countries(n, density=20, seed=n, holes=2, islands=3)[:n])
+    ]
+
+
+@pytest.mark.parametrize('n', [1, 16, 17, 300])
+def test_flatgeobuf_round_trip(tmp_path, n: int):
+    countries = _countries(n)
+    path = tmp_path / 'osm-countries-0-1.fgb'
+    write_flatgeobuf(path, countries, _Q, 1700000000.5)
+
+    assert list_layers(path).tolist() == [['osm-countries-0-1', 'MultiPolygon']]
+    info = read_info(path, force_total_bounds=True)
+    geoms = [country.geometry[_Q] for country in countries]
+    assert info['features'] == n
+    assert info['crs'] == 'EPSG:4326'
+    assert info['fields'].tolist() == ['tags', 'timestamp', 'representative_point']
+    bounds = np.array([geom.bounds for geom in geoms])
+    np.testing.assert_array_equal(info['total_bounds'], (*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0)))
+
+    # features are stored in the index order, match them by code
+    _, _, wkbs, (tags, timestamps, points) = read(path)
+    by_code = {country.tags['ISO3166-1']: country for country in countries}
+    assert len(wkbs) == n
+    for wkb, tags_json, timestamp, point_json in zip(wkbs, tags, timestamps, points, strict=True):
+        country = by_code.pop(json.loads(tags_json)['ISO3166-1'])
+        assert json.loads(tags_json) == country.tags
+        assert timestamp == 1700000000.5
+        assert json.loads(point_json) == json.loads(json.dumps(country.representative_point))
+        # every feature is a MultiPolygon
+        assert equals_exact(from_wkb(wkb), multipolygons(get_parts(country.geometry[_Q])), tolerance=0)
+    assert not by_code
+
+    # the spatial index returns exactly the features intersecting the bbox
+    rng = np.random.default_rng(n)
+    min_x, min_y, max_x, max_y = info['total_bounds']
+    for _ in range(20):
+        x, y = rng.uniform(min_x, max_x), rng.uniform(min_y, max_y)
+        bbox = (x, y, x + rng.uniform(0, 10), y + rng.uniform(0, 5))
+        _, _, wkbs, (tags, _, _) = read(path, bbox=bbox)
+        codes = {json.loads(tags_json)['ISO3166-1'] for tags_json in tags}
+        expected = {country.tags['ISO3166-1'] for country in countries if intersects(country.geometry[_Q], box(*bbox))}
+        assert codes == expected
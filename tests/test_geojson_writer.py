@@ -0,0 +1,84 @@
+import json
+import re
+
+import numpy as np
+import pytest
+from shapely import MultiPolygon, Polygon, get_coordinates, is_valid
+from shapely.geometry import mapping, shape
+
+from geojson_writer import encode_geometry, write_geojson
+from osm_countries_gen import OSMCountry
+from outputs import round_geometries
+from synthetic import synthetic_countries
+
+_Q = 0.1
+
+
+def _countries() -> list[OSMCountry]:
+    geoms = synthetic_countries(20, density=50, seed=3, enclaves=2, holes=2, islands=4)
+    geoms.append(Polygon())
+    return [
+        OSMCountry(
+            tags={'ISO3166-1': f'C{i}', 'name': f'País «{i}»', 'name:zh': '国家'},
+            geometry={_Q: geom},
+            representative_point=mapping(geom.representative_point()),
+        )
+        for i, geom in enumerate(geoms)
+    ]
+
+
+def test_write_geojson_matches_json_dumps(tmp_path):
+    countries = _countries()
+    assert any(isinstance(country.geometry[_Q], MultiPolygon) for country in countries)
+    path = tmp_path / 'osm-countries-0-1.geojson'
+    write_geojson(path, countries, _Q, 1700000000.5)
+
+    data = {
+        'type': 'FeatureCollection',
+        'name': path.stem,
+        'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'}},
+        'features': tuple(
+            {
+                'type': 'Feature',
+                'properties': {
+                    'tags': country.tags,
+                    'timestamp': 1700000000.5,
+                    'representative_point': country.representative_point,
+                },
+                'geometry': mapping(country.geometry[_Q]),
+            }
+            for country in countries
+        ),
+    }
+    expected = json.dumps(data, ensure_ascii=False, check_circular=False, allow_nan=False)
+    assert path.read_bytes() == expected.encode()
+
+
+@pytest.mark.parametrize('precision', [0, 3, 6])
+def test_encode_geometry_rounds_coordinates(precision: int):
+    for country in _countries():
+        geom = country.geometry[_Q]
+        encoded = encode_geometry(geom, precision)
+        decoded = json.loads(encoded)
+        assert decoded['type'] == geom.geom_type
+        coords = np.array(re.findall(r'-?\d+(?:\.\d+)?(?:e-?\d+)?', encoded), dtype=np.float64).reshape(-1, 2)
+        np.testing.assert_array_equal(coords, get_coordinates(geom).round(precision))
+        assert all(len(value.partition('.')[2]) <= max(precision, 1) for value in re.findall(r'[\d.]+', encoded))
+
+
+def test_encode_geometry_rejects_non_polygonal():
+    with pytest.raises(ValueError, match='Unsupported geometry type'):
+        encode_geometry(Polygon([(0, 0), (1, 0), (1, 1)]).exterior)
+
+
+def test_round_geometries_stay_valid(tmp_path):
+    # the notch apex rounds onto the bottom edge, a self-touching ring
+    notch = Polygon([(0, 0), (2, 0), (2, 2), (1.1, 2), (1, 0.0004), (0.9, 2), (0, 2)])
+    assert notch.is_valid
+    countries = [*_countries(), OSMCountry(tags={}, geometry={_Q: notch}, representative_point={})]
+    round_geometries(countries, _Q, 3)
+    path = tmp_path / 'osm-countries-0-1.geojson'
+    write_geojson(path, countries, _Q, 0.0, precision=3)
+    geoms = [shape(feature['geometry']) for feature in json.loads(path.read_bytes())['features']]
+    assert is_valid(geoms).all()
+    assert isinstance(geoms[-1], MultiPolygon)
@@ -0,0 +1,74 @@
+import asyncio
+
+import numpy as np
+import pytest
+from httpx import AsyncClient
+from shapely import box, equals_exact
+
+import geometry_cache
+import osm_countries_gen
+import overpass
+from fake_overpass import FakeOverpass, serve, synthetic_elements
+from geometry_cache import _VERSION, geometry_cache_key, load_geometry, save_geometry
+from osm_countries_gen import _assemble_geometry
+
+_OUTER = [np.array([(0.0, 0.0), (1.0, 0.0), (1.0, 1.0)]), np.array([(1.0, 1.0), (0.0, 1.0), (0.0, 0.0)])]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(geometry_cache, 'GEOMETRY_CACHE_DIR', tmp_path)
+    return tmp_path
+
+
+def test_load_matches_key():
+    key = geometry_cache_key(_OUTER, [])
+    assert load_geometry(1, key) is None
+    save_geometry(1, key, box(0, 0, 1, 1))
+    assert equals_exact(load_geometry(1, key), box(0, 0, 1, 1), tolerance=0)
+    assert load_geometry(2, key) is None
+
+    # any change of the member geometries or roles is a miss
+    moved = [_OUTER[0], np.array([(1.0, 1.0), (0.0, 1.1), (0.0, 0.0)])]
+    assert load_geometry(1, geometry_cache_key(moved, [])) is None
+    assert load_geometry(1, geometry_cache_key(_OUTER[:1], _OUTER[1:])) is None
+
+
+def test_version_invalidates(monkeypatch):
+    key = geometry_cache_key(_OUTER, [])
+    save_geometry(1, key, box(0, 0, 1, 1))
+    monkeypatch.setattr(geometry_cache, '_VERSION', _VERSION + 1)
+    assert load_geometry(1, geometry_cache_key(_OUTER, [])) is None
+
+
+def test_get_osm_countries_reuses_geometry(monkeypatch):
+    fake = FakeOverpass(synthetic_elements(20, seed=6, way_size=40))
+    assembled: list[int] = []
+
+    def assemble(outer_segments, inner_segments):
+        assembled.append(len(outer_segments))
+        return _assemble_geometry(outer_segments, inner_segments)
+
+    monkeypatch.setattr(osm_countries_gen, '_assemble_geometry', assemble)
+    monkeypatch.setattr(osm_countries_gen, 'GEOMETRY_CACHE', True)
+    monkeypatch.setattr(osm_countries_gen, 'ASSEMBLY_WORKERS', 0)
+    monkeypatch.setattr(osm_countries_gen, 'SIMPLIFY_WORKERS', 0)
+    monkeypatch.setattr(overpass, 'HTTP', AsyncClient())
+
+    with serve(fake) as url:
+        monkeypatch.setattr(overpass, 'OVERPASS_API_INTERPRETER', url)
+        first, _, _ = asyncio.run(osm_countries_gen.get_osm_countries())
+        assert len(assembled) == len(fake.relations)
+
+        assembled.clear()
+        second, _, _ = asyncio.run(osm_countries_gen.get_osm_countries())
+        assert not assembled
+        for a, b in zip(first, second, strict=True):
+            assert equals_exact(a.geometry[0.1], b.geometry[0.1], tolerance=0)
+
+        # nudge a coordinate inside the first way of one country
+        way = fake.ways[fake.relations[0]['members'][0]['ref']]
+        way['geometry'][1] = {'lat': way['geometry'][1]['lat'] + 1e-6, 'lon': way['geometry'][1]['lon']}
+        assembled.clear()
+        asyncio.run(osm_countries_gen.get_osm_countries())
+        assert len(assembled) == 1
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+from collections.abc import AsyncIterator, Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from httpx import AsyncClient
+
+import http_cache
+import natural_earth
+import overpass
+from fake_overpass import FakeOverpass, serve, synthetic_elements
+from http_cache import ResponseRecording, conditional_headers, iter_object, load_entry, read_object, request_key
+from natural_earth import _get_countries
+
+_FEATURES = {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {'NAME': 'A'}}]}
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(http_cache, '_INDEX_DIR', tmp_path / 'index')
+    monkeypatch.setattr(http_cache, '_OBJECTS_DIR', tmp_path / 'objects')
+    return tmp_path
+
+
+async def _chunks(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def _read(chunks: AsyncIterator[bytes]) -> bytes:
+    return b''.join([chunk async for chunk in chunks])
+
+
+def _record(key: str, chunks: AsyncIterator[bytes], headers: dict[str, str]) -> bytes:
+    recording = ResponseRecording(key)
+    content = asyncio.run(_read(recording.record(chunks)))
+    recording.commit('https://example.com', headers)
+    return content
+
+
+def test_record_replaces_and_prunes(cache_dir):
+    key = request_key('POST', 'https://example.com', {'data': 'query'})
+    assert key != request_key('POST', 'https://example.com', {'data': 'other'})
+    assert load_entry(key) is None
+
+    headers = {'ETag': '"1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    assert _record(key, _chunks(b'ab', b'c'), headers) == b'abc'
+    entry = load_entry(key)
+    assert entry is not None
+    assert read_object(entry) == b'abc'
+    assert asyncio.run(_read(iter_object(entry))) == b'abc'
+    assert conditional_headers(entry) == {'If-None-Match': '"1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+    _record(key, _chunks(b'abcd'), {})
+    entry = load_entry(key)
+    assert entry is not None
+    assert read_object(entry) == b'abcd'
+    assert conditional_headers(entry) == {}
+    assert [path.name for path in (cache_dir / 'objects').iterdir()] == [entry.object]
+
+
+def test_discarded_recording_keeps_entry(cache_dir):
+    key = request_key('POST', 'https://example.com', {'data': 'query'})
+    _record(key, _chunks(b'abc'), {})
+
+    # a response rejected by the caller is not committed
+    recording = ResponseRecording(key)
+    assert asyncio.run(_read(recording.record(_chunks(b'rejected')))) == b'rejected'
+    recording.discard()
+    entry = load_entry(key)
+    assert entry is not None
+    assert read_object(entry) == b'abc'
+    assert [path.name for path in (cache_dir / 'objects').iterdir()] == [entry.object]
+
+
+_requests: list[str | None] = []  # If-None-Match of the requests
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        etag = self.headers.get('If-None-Match')
+        _requests.append(etag)
+        if etag == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(_FEATURES).encode()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+@pytest.fixture
+def countries_url(monkeypatch) -> Iterator[str]:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/countries.geojson'
+    monkeypatch.setattr(natural_earth, 'COUNTRIES_GEOJSON_URL', url)
+    monkeypatch.setattr(natural_earth, 'HTTP', AsyncClient())
+    _requests.clear()
+    try:
+        yield url
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_not_modified_reads_cache(monkeypatch, countries_url):
+    features = _FEATURES['features']
+    assert asyncio.run(_get_countries()) == features
+    assert asyncio.run(_get_countries()) == features
+    assert _requests == [None, '"v1"']
+
+    monkeypatch.setattr(natural_earth, 'HTTP_CACHE_MODE', 'replay')
+    assert asyncio.run(_get_countries()) == features
+    assert len(_requests) == 2
+
+    monkeypatch.setattr(natural_earth, 'COUNTRIES_GEOJSON_URL', countries_url + '?missing')
+    with pytest.raises(Exception, match='No recorded Natural Earth response'):
+        asyncio.run(_get_countries())
+
+
+def test_overpass_replay(monkeypatch):
+    fake = FakeOverpass(synthetic_elements(10, seed=7, way_size=30))
+    monkeypatch.setattr(overpass, 'HTTP', AsyncClient())
+    monkeypatch.setattr(overpass, 'HTTP_CACHE_MODE', 'record')
+    with serve(fake) as url:
+        monkeypatch.setattr(overpass, 'OVERPASS_API_INTERPRETER', url)
+        recorded = asyncio.run(
+            overpass.query_overpass_sharded(['rel[name];out geom qt;'], http_timeout=30, concurrency=1)
+        )
+
+    # the server is gone, the response comes from the cache
+    monkeypatch.setattr(overpass, 'HTTP_CACHE_MODE', 'replay')
+    replayed = asyncio.run(overpass.query_overpass_sharded(['rel[name];out geom qt;'], http_timeout=30, concurrency=1))
+    assert len(fake.queries) == 1
+    assert replayed[1] == recorded[1]
+    assert [element['id'] for element in replayed[0]] == [element['id'] for element in recorded[0]]
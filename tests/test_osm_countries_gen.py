@@ -0,0 +1,140 @@
+from collections.abc import Sequence
+from itertools import cycle, islice, pairwise
+
+import networkx as nx
+import pytest
+from shapely import Polygon, equals_exact
+
+from osm_countries_gen import _connect_segments, _count_nodes, _normalize_ring, _simplify, _simplify_parallel
+from synthetic import split_rings, synthetic_countries
+from toposimplify import Topology
+
+# square corners, counter-clockwise
+_A, _B, _C, _D = (0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)
+_E, _F = (2.0, 0.0), (2.0, 1.0)
+_G, _H = (2.0, 2.0), (1.0, 2.0)
+
+# member ways shaped like real relations
+_REAL_SEGMENTS = {
+    'closed way': [(_A, _B, _C, _D, _A)],
+    'ring split into ways, mixed directions': [(_A, _B), (_C, _B), (_C, _D, _A)],
+    'duplicate member way': [(_A, _B, _C), (_C, _D, _A), (_C, _D, _A)],
+    'exclaves touching at a node': [(_A, _B, _C, _D, _A), (_C, _F, _G, _H, _C)],
+    'adjacent areas sharing a way': [(_A, _B, _C, _D, _A), (_B, _E, _F, _C), (_B, _C)],
+    'ring passing twice through a node': [(_A, _B, _C), (_C, _D, _A), (_C, _F, _G), (_G, _H, _C)],
+}
+
+
+def _connect_segments_nx(segments: Sequence[tuple[tuple, ...]]) -> set[Sequence[tuple]]:
+    # reference implementation enumerating all simple cycles, slow on many intersections
+    node_count = _count_nodes(segments)
+
+    # node = intersection, node_count > 1
+    # edge = segment between intersections
+    graph = nx.DiGraph()
+
+    # build the graph
+    for segment in segments:
+        subsegment_start = None
+        subsegment = []
+        for node in segment:
+            # intersection node
+            if node_count[node] > 1:
+                if subsegment_start:
+                    if len(subsegment) == 0:
+                        graph.add_edge(subsegment_start, node)
+                        graph.add_edge(node, subsegment_start)
+                    elif len(subsegment) == 1:
+                        first = subsegment[0]
+                        graph.add_edge(subsegment_start, first)
+                        graph.add_edge(first, node)
+                        graph.add_edge(node, first)
+                        graph.add_edge(first, subsegment_start)
+                    else:
+                        first = subsegment[0]
+                        last = subsegment[-1]
+                        graph.add_edge(subsegment_start, first)
+                        graph.add_edge(first, last, subsegment=subsegment)
+                        graph.add_edge(last, node)
+                        graph.add_edge(node, last)
+                        graph.add_edge(last, first, subsegment=subsegment[::-1])
+                        graph.add_edge(first, subsegment_start)
+                subsegment = []
+                subsegment_start = node
+            # normal node
+            elif subsegment_start:
+                subsegment.append(node)
+
+    # set to store connected segments (closed loops)
+    connected = set()
+
+    for c in nx.simple_cycles(graph):
+        c = tuple(islice(cycle(c), len(c) + 1))  # close the cycle
+
+        merged_unordered: list[list] = []
+
+        for u, v in pairwise(c):
+            if subsegment := graph[u][v].get('subsegment'):
+                merged_unordered.append(subsegment)
+            else:
+                merged_unordered.append([u, v])
+
+        if len(merged_unordered) < 2:
+            # this realistically will mean broken data: a single node, a small loop, etc.
+            print(f'⚠️ Single-segment cycle: {c!r}')
+            continue
+
+        first = merged_unordered[0]
+        second = merged_unordered[1]
+
+        # proper orientation of the first segment
+        if first[0] in (second[0], second[-1]):  # noqa: SIM108
+            merged = first[::-1]
+        else:
+            merged = first
+
+        for segment in merged_unordered[1:]:
+            if merged[-1] == segment[0]:
+                merged.extend(islice(segment, 1, None))
+            elif merged[-1] == segment[-1]:
+                merged.extend(islice(reversed(segment), 1, None))
+            else:
+                print('⚠️ Invalid cycle')
+                break
+        else:
+            if len(merged) >= 4 and merged[1] != merged[-2]:
+                connected.add(_normalize_ring(merged))
+
+    return connected
+
+
+def _valid_rings(rings: set[Sequence[tuple]]) -> set[Sequence[tuple]]:
+    # invalid rings are discarded by the assembly, the enumeration of cycles finds many more of them
+    return {ring for ring in rings if Polygon(ring).is_valid}
+
+
+@pytest.mark.parametrize('name', list(_REAL_SEGMENTS))
+def test_connect_segments_matches_cycles_real(name: str):
+    segments = _REAL_SEGMENTS[name]
+    result = _connect_segments(segments)
+    assert result
+    assert _valid_rings(result) == _valid_rings(_connect_segments_nx(segments))
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_connect_segments_matches_cycles_synthetic(seed: int):
+    for geom in synthetic_countries(40, density=50, seed=seed):
+        for segments_coords in split_rings(geom, 30):
+            segments = [tuple(map(tuple, coords.tolist())) for coords in segments_coords]
+            assert _valid_rings(_connect_segments(segments)) == _valid_rings(_connect_segments_nx(segments))
+
+
+def test_simplify_parallel_matches_serial():
+    topo = Topology(synthetic_countries(30, density=100, seed=5, enclaves=2, holes=2))
+    qualities = (0.001, 0.01, 0.1)
+    countries_geoms_q = [{} for _ in range(len(topo))]
+    repaired_q = _simplify_parallel(topo, countries_geoms_q, qualities, workers=2)
+    for q in qualities:
+        geoms, repaired = _simplify(topo, q)
+        assert repaired_q[q] == repaired
+        assert equals_exact([country_geoms_q[q] for country_geoms_q in countries_geoms_q], geoms, tolerance=0).all()
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+import http_cache
+import overpass
+from fake_overpass import FakeOverpass, serve, synthetic_elements
+from http_cache import _commit
+from osm_countries_gen import _QUERY, _QUERY_OUT, _shard_queries
+from overpass import query_overpass_sharded
+
+_T0 = '2024-01-01T00:00:00Z'
+_T1 = '2024-01-01T00:01:00Z'
+_T2 = '2024-01-01T00:02:00Z'
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeOverpass(synthetic_elements(60, seed=4, way_size=50), _T1)
+    with serve(fake) as url:
+        # a client without the SSRF protection, which rejects the loopback interface
+        monkeypatch.setattr(overpass, 'HTTP', AsyncClient())
+        monkeypatch.setattr(overpass, 'OVERPASS_API_INTERPRETER', url)
+        yield fake
+
+
+def _query(queries: list[str]) -> tuple[list[dict], float]:
+    elements, data_timestamp = asyncio.run(query_overpass_sharded(queries, http_timeout=30, concurrency=3))
+    return list(elements), data_timestamp
+
+
+def _ids(elements: list[dict]) -> list[tuple[str, int]]:
+    return sorted((element['type'], element['id']) for element in elements)
+
+
+def test_shards_match_single_query(fake: FakeOverpass):
+    expected, expected_timestamp = _query([_QUERY])
+    fake.queries.clear()
+    elements, data_timestamp = _query(_shard_queries(5, _QUERY_OUT))
+    assert len(fake.queries) == 5
+    assert fake.max_active <= 3
+    assert _ids(elements) == _ids(expected)
+    assert len(elements) == len(fake.relations)
+    assert data_timestamp == expected_timestamp
+
+
+def test_shards_pinned_to_first_timestamp(fake: FakeOverpass):
+    # the database advances after the first shard, and one server is still behind it
+    fake.timestamps = [_T1, _T0]
+    fake.timestamp = _T2
+    elements, data_timestamp = _query(_shard_queries(3, _QUERY_OUT))
+    assert len(fake.queries) == 4
+    assert all(f'[date:"{_T1}"]' in query for query in fake.queries[1:])
+    assert '[date:' not in fake.queries[0]
+    assert len(elements) == len(fake.relations)
+    assert data_timestamp == 1704067260
+
+
+def test_retries_gateway_timeout(fake: FakeOverpass):
+    fake.fail_requests = 2
+    elements, _ = _query(_shard_queries(2, _QUERY_OUT))
+    assert len(fake.queries) == 4
+    assert len(elements) == len(fake.relations)
+
+
+def test_record_keeps_one_entry_per_shard(fake: FakeOverpass, monkeypatch, tmp_path):
+    index_dir = tmp_path / 'index'
+    monkeypatch.setattr(http_cache, '_INDEX_DIR', index_dir)
+    monkeypatch.setattr(http_cache, '_OBJECTS_DIR', tmp_path / 'objects')
+    monkeypatch.setattr(overpass, 'HTTP_CACHE_MODE', 'record')
+    committed: list[str] = []
+
+    def record_commit(key, *args):
+        committed.append(key)
+        _commit(key, *args)
+
+    monkeypatch.setattr(http_cache, '_commit', record_commit)
+
+    # the response of the server behind the pinned date is not recorded
+    fake.timestamps = [_T1, _T0]
+    fake.timestamp = _T2
+    _query(_shard_queries(3, _QUERY_OUT))
+    assert len(fake.queries) == 4
+    assert len(committed) == 3
+    assert len(set(committed)) == 3
+
+    # shards pinned to a new date replace their previous recordings
+    fake.timestamp = '2024-01-02T00:00:00Z'
+    _query(_shard_queries(3, _QUERY_OUT))
+    assert sorted(path.stem for path in index_dir.iterdir()) == sorted(set(committed))
+
+    # recordings of shards no longer queried are dropped
+    expected, expected_timestamp = _query(_shard_queries(2, _QUERY_OUT))
+    assert len(list(index_dir.iterdir())) == 2
+    assert len(list((tmp_path / 'objects').iterdir())) == 2
+
+    monkeypatch.setattr(overpass, 'HTTP_CACHE_MODE', 'replay')
+    fake.queries.clear()
+    elements, data_timestamp = _query(_shard_queries(2, _QUERY_OUT))
+    assert not fake.queries
+    assert _ids(elements) == _ids(expected)
+    assert data_timestamp == expected_timestamp
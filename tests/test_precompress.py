@@ -0,0 +1,28 @@
+import gzip
+
+import brotli
+import pytest
+import zstandard
+
+from precompress import precompress
+
+_DECOMPRESS = {
+    'gz': gzip.decompress,
+    'br': brotli.decompress,
+    'zst': zstandard.decompress,
+}
+
+
+@pytest.mark.parametrize('fmt', list(_DECOMPRESS))
+def test_precompress_round_trip(tmp_path, fmt: str):
+    data = b''.join(
+        b'{"type":"Feature","id":%d,"coordinates":[%d.5,%d.25]},' % (i, i % 97, i % 89) for i in range(20000)
+    )
+    path = tmp_path / 'osm-countries-0-1.geojson'
+    path.write_bytes(data)
+    result = precompress(path, fmt)
+    assert result.name == f'osm-countries-0-1.geojson.{fmt}'
+    compressed = result.read_bytes()
+    assert _DECOMPRESS[fmt](compressed) == data
+    if fmt == 'gz':
+        assert len(compressed) < len(gzip.compress(data, 9, mtime=0))
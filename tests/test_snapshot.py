@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from shapely import equals_exact
+
+from osm_countries_gen import OSMCountry
+from snapshot import load_snapshot, save_snapshot
+from synthetic import synthetic_countries
+from toposimplify import Topology
+
+
+def _countries(n: int, seed: int) -> tuple[list[OSMCountry], Topology]:
+    topo = Topology(synthetic_countries(n, density=50, seed=seed))
+    countries = [
+        OSMCountry(
+            tags={'name': f'Země {i}', 'ISO3166-1': f'A{i}'},
+            geometry={},
+            representative_point={'type': 'Point', 'coordinates': [i, -i]},
+        )
+        for i in range(len(topo))
+    ]
+    return countries, topo
+
+
+def test_round_trip(tmp_path: Path):
+    path = tmp_path / 'snapshot'
+    countries, topo = _countries(20, seed=1)
+    save_snapshot(path, countries, 1704067200.0, topo)
+
+    loaded_countries, data_timestamp, loaded_topo = load_snapshot(path)
+    assert data_timestamp == 1704067200.0
+    assert [c.tags for c in loaded_countries] == [c.tags for c in countries]
+    assert [c.representative_point for c in loaded_countries] == [c.representative_point for c in countries]
+    assert all(not c.geometry for c in loaded_countries)
+
+    # the arrays are memory-mapped, not read into memory
+    assert isinstance(loaded_topo._coords, np.memmap)  # noqa: SLF001
+    assert isinstance(loaded_topo._significance, np.memmap)  # noqa: SLF001
+    for tolerance in (0, 0.01, 0.1):
+        assert equals_exact(loaded_topo.simplify(tolerance), topo.simplify(tolerance), tolerance=0).all()
+
+
+def test_replaces_existing(tmp_path: Path):
+    path = tmp_path / 'snapshot'
+    countries, topo = _countries(20, seed=1)
+    save_snapshot(path, countries, 1.0, topo)
+    new_countries, new_topo = _countries(5, seed=2)
+    save_snapshot(path, new_countries, 2.0, new_topo)
+
+    loaded_countries, data_timestamp, loaded_topo = load_snapshot(path)
+    assert data_timestamp == 2.0
+    assert len(loaded_countries) == len(loaded_topo) == len(new_topo)
+    assert equals_exact(loaded_topo.simplify(0.01), new_topo.simplify(0.01), tolerance=0).all()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['snapshot']
+
+
+def test_failed_save_keeps_existing(tmp_path: Path):
+    path = tmp_path / 'snapshot'
+    countries, topo = _countries(5, seed=1)
+    save_snapshot(path, countries, 1.0, topo)
+    with pytest.raises(TypeError):
+        save_snapshot(path, countries, object(), topo)  # pyright: ignore[reportArgumentType]
+    assert load_snapshot(path)[1] == 1.0
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['snapshot']
+
+
+def test_rejects_old_version(tmp_path: Path):
+    path = tmp_path / 'snapshot'
+    countries, topo = _countries(5, seed=1)
+    save_snapshot(path, countries, 1.0, topo)
+    data = json.loads((path / 'countries.json').read_text())
+    data['version'] -= 1
+    (path / 'countries.json').write_text(json.dumps(data))
+    with pytest.raises(ValueError, match='Unsupported snapshot version'):
+        load_snapshot(path)
@@ -0,0 +1,117 @@
+from itertools import pairwise
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+from shapely import MultiPolygon, Polygon, equals_exact
+
+from synthetic import synthetic_countries
+from toposimplify import Topology, _douglas_peucker, _douglas_peucker_batch, _find_endpoints, _get_rings
+
+_TOLERANCES = (0, 1e-5, 1e-4, 1e-3, 0.01, 0.1, 1)
+
+
+def _random_arcs(rng: np.random.Generator) -> list[NDArray[np.complexfloating]]:
+    arcs: list[NDArray[np.complexfloating]] = []
+    for size in rng.integers(2, 200, 300).tolist():
+        arc = np.cumsum(rng.normal(size=size) + rng.normal(size=size) * 1j).round(2)
+        if rng.random() < 0.2:
+            arc[-1] = arc[0]  # closed arc
+        if rng.random() < 0.2:
+            arc[rng.integers(size)] = arc[0]  # repeated point
+        arcs.append(arc)
+    return arcs
+
+
+def test_douglas_peucker_batch_matches_single():
+    arcs = _random_arcs(np.random.default_rng(0))
+    arcs_offsets = np.concatenate(((0,), np.cumsum([len(arc) for arc in arcs])))
+    expected = np.concatenate([_douglas_peucker(arc) for arc in arcs])
+    # a small chunk size exercises the chunking
+    for chunk_size in (1 << 20, 64):
+        significance = _douglas_peucker_batch(np.concatenate(arcs), arcs_offsets, chunk_size=chunk_size)
+        np.testing.assert_array_equal(significance, expected)
+
+
+def _douglas_peucker_tolerance(coords: NDArray[np.complexfloating], tolerance: float) -> tuple[NDArray, float]:
+    # classic Douglas-Peucker at a fixed tolerance, also returns the largest rejected distance
+    keep = np.zeros(len(coords), dtype=np.bool_)
+    keep[0] = keep[-1] = True
+    max_distance = 0.0
+    stack = [(0, len(coords) - 1)] if len(coords) > 2 else []
+    while stack:
+        start_idx, end_idx = stack.pop()
+        start = coords[start_idx]
+        end = coords[end_idx]
+        u = coords[start_idx + 1 : end_idx] - start
+        segment = end - start
+        distances = np.abs(u) if start == end else np.abs(np.imag(np.conj(segment) * u)) / np.abs(segment)
+        max_idx = int(np.argmax(distances))
+        if distances[max_idx] >= tolerance:
+            idx = start_idx + max_idx + 1
+            keep[idx] = True
+            if idx - start_idx > 1:
+                stack.append((start_idx, idx))
+            if end_idx - idx > 1:
+                stack.append((idx, end_idx))
+        else:
+            max_distance = max(max_distance, float(distances[max_idx]))
+    return coords[keep], max_distance
+
+
+def _baseline_simplify(geoms: list[Polygon | MultiPolygon], tolerance: float) -> list[Polygon | MultiPolygon]:
+    # per-tolerance simplification of every arc, lowering the ring tolerance until at least 3 coords remain
+    coords, rings_offsets, polys_sizes, geoms_sizes = _get_rings(geoms)
+    endpoints = set(_find_endpoints(coords, rings_offsets).tolist())
+    rings: list[NDArray[np.floating]] = []
+    for ring_start, ring_end in zip(rings_offsets[:-1].tolist(), rings_offsets[1:].tolist(), strict=True):
+        ring = coords[ring_start:ring_end]
+        splits = [i for i, point in enumerate(ring.tolist()) if point in endpoints] or [0]
+        ring = np.append(np.roll(ring, -splits[0]), ring[splits[0]])
+        splits = [split - splits[0] for split in splits] + [len(ring) - 1]
+        ring_tolerance = tolerance
+        while True:
+            arcs, distances = zip(
+                *(_douglas_peucker_tolerance(ring[start : end + 1], ring_tolerance) for start, end in pairwise(splits)),
+                strict=True,
+            )
+            simplified = np.concatenate([arc[:-1] for arc in arcs])
+            if len(simplified) >= 3 or max(distances) == 0:
+                break
+            ring_tolerance = min(ring_tolerance, max(distances))
+        rings.append(np.column_stack((np.real(simplified), np.imag(simplified))))
+
+    polys: list[Polygon] = []
+    for poly_start, poly_end in zip(np.cumsum(polys_sizes) - polys_sizes, np.cumsum(polys_sizes), strict=True):
+        polys.append(Polygon(rings[poly_start], rings[poly_start + 1 : poly_end]))
+    return [
+        polys[start] if end - start == 1 else MultiPolygon(polys[start:end])
+        for start, end in zip(np.cumsum(geoms_sizes) - geoms_sizes, np.cumsum(geoms_sizes), strict=True)
+    ]
+
+
+@pytest.mark.parametrize('tolerance', _TOLERANCES)
+def test_simplify_matches_baseline(tolerance: float):
+    geoms = synthetic_countries(30, density=100, seed=1, enclaves=3, holes=3, islands=5)
+    result = Topology(geoms).simplify(tolerance)
+    expected = _baseline_simplify(geoms, tolerance)
+    assert len(result) == len(expected)
+    assert equals_exact(result, expected, tolerance=0).all()
+
+
+def test_simplify_range_matches_full():
+    geoms = synthetic_countries(30, density=100, seed=2)
+    topo = Topology(geoms)
+    full = topo.simplify(0.01)
+    parts = [geom for start, stop in topo.partition(4) for geom in topo.simplify(0.01, start, stop)]
+    assert equals_exact(parts, full, tolerance=0).all()
+
+
+def test_attach_matches_shared():
+    geoms = synthetic_countries(30, density=100, seed=4, holes=3)
+    topo = Topology(geoms)
+    with topo.share() as shared:
+        attached = Topology.attach(shared)
+        assert len(attached) == len(topo)
+        assert equals_exact(attached.simplify(0.01, 5, 20), topo.simplify(0.01, 5, 20), tolerance=0).all()
+        del attached
@@ -0,0 +1,108 @@
+import gzip
+import json
+import sqlite3
+from contextlib import closing
+
+import mapbox_vector_tile
+import numpy as np
+import pytest
+from shapely import MultiPolygon, Polygon, box, clip_by_rect, hausdorff_distance, transform
+from shapely.affinity import translate
+from shapely.geometry import shape
+
+import vector_tiles
+from config import GEOJSON_QUALITIES
+from osm_countries_gen import OSMCountry
+from vector_tiles import _EXTENT, _TAGS, _project, _tile_bounds, write_mbtiles, zoom_quality
+
+_MAX_ZOOM = 5
+
+
+def _countries() -> list[OSMCountry]:
+    # each quality is shifted east by 100 q degrees, so tiles show which quality they were built from
+    donut = Polygon(box(-100, 10, -60, 50).exterior, [box(-90, 20, -70, 40).exterior])
+    shapes = [MultiPolygon([donut, box(-50, 10, -40, 20)]), box(20, -40, 60, -10)]
+    return [
+        OSMCountry(
+            tags={'ISO3166-1': f'C{i}', 'name': f'Country {i}', 'boundary': 'administrative'},
+            geometry={q: translate(geom, xoff=100 * q) for q in GEOJSON_QUALITIES},
+            representative_point={},
+        )
+        for i, geom in enumerate(shapes)
+    ]
+
+
+def _signed_area(ring: list[list[int]]) -> int:
+    # positive for exterior rings in tile coordinates, with y pointing down
+    x, y = np.array(ring[:-1]).T
+    return int(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+@pytest.fixture(scope='module')
+def tiles(tmp_path_factory) -> dict[tuple[int, int, int], dict]:
+    path = tmp_path_factory.mktemp('tiles') / 'osm-countries.mbtiles'
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(vector_tiles, 'VECTOR_TILES_WORKERS', 0)
+        write_mbtiles(path, _countries(), _MAX_ZOOM)
+    with closing(sqlite3.connect(path)) as db:
+        metadata = dict(db.execute('SELECT name, value FROM metadata'))
+        rows = db.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles').fetchall()
+    assert metadata['format'] == 'pbf'
+    assert (metadata['minzoom'], metadata['maxzoom']) == ('0', str(_MAX_ZOOM))
+    assert json.loads(metadata['json'])['vector_layers'][0]['id'] == 'countries'
+    return {
+        (z, x, row): mapbox_vector_tile.decode(gzip.decompress(data), default_options={'y_coord_down': True})
+        for z, x, row, data in rows
+    }
+
+
+def test_zoom_quality():
+    assert [zoom_quality(zoom) for zoom in range(14)] == [0.1] * 4 + [0.01] * 4 + [0.001] * 3 + [0.0001] * 3
+
+
+def test_tile_rows_are_flipped(tiles):
+    # the first country is north-west of the origin, the second south-east, rows are numbered from the bottom
+    assert sorted(key for key in tiles if key[0] == 1) == [(1, 0, 1), (1, 1, 0)]
+    for (z, _, row), tile in tiles.items():
+        if z:
+            ids = {feature['id'] for feature in tile['countries']['features']}
+            assert ids == ({0} if row >= 1 << (z - 1) else {1})
+
+
+def test_tiles_match_clipped_geometry(tiles):
+    countries = _countries()
+    expected_keys = set()
+    for z in range(_MAX_ZOOM + 1):
+        q = zoom_quality(z)
+        geoms = transform([country.geometry[q] for country in countries], _project)
+        for x in range(1 << z):
+            for y in range(1 << z):
+                clipped = clip_by_rect(geoms, *_tile_bounds(z, x, y))
+                if not any(not geom.is_empty for geom in clipped):
+                    continue
+                key = (z, x, (1 << z) - 1 - y)
+                expected_keys.add(key)
+                layer = tiles[key]['countries']
+                assert layer['extent'] == _EXTENT
+                for feature in layer['features']:
+                    assert set(feature['properties']) == set(_TAGS) & set(countries[feature['id']].tags)
+                    geometry = feature['geometry']
+                    polygons = (
+                        geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+                    )
+                    for rings in polygons:
+                        assert _signed_area(rings[0]) > 0
+                        assert all(_signed_area(ring) < 0 for ring in rings[1:])
+
+                    # absolute positions, including rings after the first, come from the cursor deltas
+                    decoded = transform(
+                        shape(geometry), lambda c, z=z, x=x, y=y: (c + np.array((x, y)) * _EXTENT) / (_EXTENT << z)
+                    )
+                    assert hausdorff_distance(decoded, clipped[feature['id']]) <= 1 / (_EXTENT << z)
+    assert set(tiles) == expected_keys
+
+
+def test_multiple_rings_per_feature(tiles):
+    geometry = tiles[0, 0, 0]['countries']['features'][0]['geometry']
+    assert geometry['type'] == 'MultiPolygon'
+    assert [len(rings) for rings in geometry['coordinates']] == [2, 1]
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from shapely import equals_exact
+
+from config import GEOJSON_QUALITIES
+from fake_overpass import synthetic_elements
+from osm_countries_gen import _assemble_geometry, _get_segments, _load_shared_ways, _polygonal
+from overpass import _compact_element
+from toposimplify import Topology, _find_endpoints, _get_rings
+from way_store import WayStore
+
+
+def _share_ways(elements: list[dict]) -> list[dict]:
+    # let relations reference a single copy of identical ways, like OSM border ways
+    ways_ids: dict[tuple, int] = {}
+    remap: dict[int, int] = {}
+    result: list[dict] = []
+    for element in elements:
+        if element['type'] == 'way':
+            nodes = tuple(element['nodes'])
+            way_id = ways_ids.get(nodes) or ways_ids.get(nodes[::-1])
+            if way_id is not None:
+                remap[element['id']] = way_id
+                continue
+            ways_ids[nodes] = element['id']
+        result.append(element)
+    for element in result:
+        for member in element.get('members', ()):
+            member['ref'] = remap.get(member['ref'], member['ref'])
+    return result
+
+
+def _split_nodes(elements: list[dict]) -> list[dict]:
+    # give every way its own nodes, neighbouring borders then only share coords
+    for element in elements:
+        if element['type'] == 'way':
+            element['nodes'] = [element['id'] * 1_000_000 + i for i in range(len(element['nodes']))]
+    return elements
+
+
+@pytest.mark.parametrize('mode', ['shared', 'duplicated', 'split nodes'])
+def test_shared_ways_match_non_shared(mode: str):
+    elements = synthetic_elements(25, seed=1, way_size=30)
+    if mode == 'shared':
+        elements = _share_ways(elements)
+    elif mode == 'split nodes':
+        elements = _split_nodes(elements)
+    ways = {element['id']: element for element in elements if element['type'] == 'way'}
+
+    # regular query: member ways with inline geometries
+    relations = [
+        _compact_element({
+            **element,
+            'members': [{**member, 'geometry': ways[member['ref']]['geometry']} for member in element['members']],
+        })
+        for element in elements
+        if element['type'] == 'relation'
+    ]
+    geoms = _polygonal([_assemble_geometry(*_get_segments(relation)) for relation in relations])
+
+    # shared ways query: relations and ways separately
+    countries, way_store = _load_shared_ways([_compact_element(element) for element in elements])
+    junctions = way_store.junctions(countries)
+    shared_geoms = _polygonal([_assemble_geometry(*_get_segments(country)) for country in countries])
+
+    coords, rings_offsets, _, _ = _get_rings(geoms)
+    np.testing.assert_array_equal(junctions, _find_endpoints(coords, rings_offsets))
+    topo = Topology(geoms)
+    shared_topo = Topology(shared_geoms, junctions)
+    for q in (0, *GEOJSON_QUALITIES):
+        assert equals_exact(shared_topo.simplify(q), topo.simplify(q), tolerance=0).all()
+
+
+def test_junctions_skip_way_continuations():
+    # a square made of two ways of one relation, and a triangle of another relation touching one corner
+    square = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
+    ways = [
+        {'id': 1, 'nodes': [1, 2, 3], 'geometry': np.array(square[:3])},
+        {'id': 2, 'nodes': [3, 4, 1], 'geometry': np.array([*square[2:], square[0]])},
+        {'id': 3, 'nodes': [3, 5, 6, 3], 'geometry': np.array([square[2], (2.0, 1.0), (2.0, 2.0), square[2]])},
+    ]
+    relations = [
+        {'members': [{'type': 'way', 'ref': 1}, {'type': 'way', 'ref': 2}]},
+        {'members': [{'type': 'way', 'ref': 3}]},
+    ]
+    np.testing.assert_array_equal(WayStore(ways[:2]).junctions(relations[:1]), [])
+    np.testing.assert_array_equal(WayStore(ways).junctions(relations), [1 + 1j])
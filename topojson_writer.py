@@ -0,0 +1,92 @@
+import json
+from collections.abc import Sequence
+from itertools import pairwise
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+
+from osm_countries_gen import OSMCountry
+from toposimplify import TopologyArcs
+
+_OBJECT_NAME = 'countries'
+
+
+def write_topojson(
+    path: Path,
+    countries: Sequence[OSMCountry],
+    topology_arcs: TopologyArcs,
+    data_timestamp: float,
+    *,
+    precision: int | None = None,
+) -> None:
+    # shared borders are written once, precision enables quantized and delta-encoded arcs
+    arcs = topology_arcs.arcs
+    arcs_coords = np.vstack(arcs) if arcs else np.empty((0, 2))
+    if not np.isfinite(arcs_coords).all():
+        raise ValueError('Out of range float values are not JSON compliant')
+    arcs_offsets = np.cumsum([0, *map(len, arcs)])
+
+    topology: dict = {'type': 'Topology'}
+    if len(arcs_coords):
+        bbox = (*arcs_coords.min(axis=0).tolist(), *arcs_coords.max(axis=0).tolist())
+        topology['bbox'] = bbox
+    else:
+        bbox = (0.0, 0.0, 0.0, 0.0)
+
+    if precision is not None:
+        scale = 10.0**-precision
+        translate = (round(bbox[0], precision), round(bbox[1], precision))
+        topology['transform'] = {'scale': [scale, scale], 'translate': list(translate)}
+        encoded_arcs = _encode_arcs_quantized(arcs_coords, arcs_offsets, scale, translate)
+    else:
+        encoded_arcs = [_dumps(arcs_coords[start:end].tolist()) for start, end in pairwise(arcs_offsets.tolist())]
+
+    geometries = []
+    for country, geom in zip(countries, topology_arcs.geoms, strict=True):
+        geometries.append({
+            'type': 'Polygon' if len(geom) == 1 else 'MultiPolygon',
+            'arcs': geom[0] if len(geom) == 1 else geom,
+            'properties': {
+                'tags': country.tags,
+                'timestamp': data_timestamp,
+                'representative_point': country.representative_point,
+            },
+        })
+    topology['objects'] = {_OBJECT_NAME: {'type': 'GeometryCollection', 'geometries': geometries}}
+
+    with path.open('w') as f:
+        f.write(_dumps(topology)[:-1])
+        f.write(',"arcs":[')
+        f.write(','.join(encoded_arcs))
+        f.write(']}')
+
+
+def _encode_arcs_quantized(
+    arcs_coords: NDArray[np.floating],
+    arcs_offsets: NDArray[np.integer],
+    scale: float,
+    translate: tuple[float, float],
+) -> list[str]:
+    quantized = np.rint((arcs_coords - translate) / scale).astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    deltas[arcs_offsets[:-1]] = quantized[arcs_offsets[:-1]]
+
+    # skip points that collapsed into their predecessor, but keep at least two points per arc
+    keep = (deltas != 0).any(axis=1)
+    keep[arcs_offsets[:-1]] = True
+    keep_indices = np.flatnonzero(keep)
+    kept_offsets = np.searchsorted(keep_indices, arcs_offsets)
+    values = deltas[keep].tolist()
+
+    result: list[str] = []
+    for start, end in pairwise(kept_offsets.tolist()):
+        arc = values[start:end]
+        if len(arc) == 1:
+            arc.append([0, 0])
+        result.append(_dumps(arc))
+    return result
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, check_circular=False, allow_nan=False, separators=(',', ':'))
@@ -1,122 +1,414 @@
-from collections.abc import Collection, Iterable, Sequence
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from itertools import pairwise
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
 from typing import NamedTuple
 
 import numpy as np
 from numpy.typing import NDArray
-from shapely import LinearRing, get_coordinates, linearrings, multipolygons, polygons
+from shapely import (
+    LinearRing,
+    get_coordinates,
+    get_num_coordinates,
+    get_parts,
+    get_rings,
+    linearrings,
+    multipolygons,
+    polygons,
+)
 from shapely.geometry import MultiPolygon, Polygon
 
 
-class _RingData(NamedTuple):
-    geom_id: int
-    poly_id: int
+class _Rings(NamedTuple):
+    # vertices of all rings in a single buffer, without the closing points,
+    # ring i spans coords[offsets[i] : offsets[i + 1]]
     coords: NDArray[np.complexfloating]
+    offsets: NDArray[np.integer]
+    polys_sizes: list[int]
+    geoms_sizes: list[int]
 
 
-class _SplitRingData(NamedTuple):
-    geom_id: int
-    poly_id: int
-    arcs: Sequence[NDArray[np.complexfloating]]
+class _SharedArray(NamedTuple):
+    name: str
+    dtype: str
+    shape: tuple[int, ...]
 
 
-class Topology:
-    __slots__ = ('_rings',)
-    _rings: Collection[_SplitRingData]
+class SharedTopology(NamedTuple):
+    coords: _SharedArray
+    significance: _SharedArray
+    rings_offsets: _SharedArray
+    polys_sizes: list[int]
+    geoms_sizes: list[int]
 
-    def __init__(self, geoms: Iterable[Polygon | MultiPolygon]):
-        coords_data = _get_rings_data(geoms)
-        endpoints = _find_endpoints(coords_data)
-        self._rings = _split_into_arcs(coords_data, endpoints)
 
-    def simplify(self, tolerance: float) -> list[Polygon | MultiPolygon]:
-        polys, geoms_sizes = _reconstruct_polys(_simplify_arcs(self._rings, tolerance))
-        return _reconstruct_geoms(polys, geoms_sizes)
+class TopologyArcs(NamedTuple):
+    arcs: list[NDArray[np.floating]]
+    # geoms -> polys -> rings -> arc indices, negative indices (~i) refer to reversed arcs
+    geoms: list[list[list[list[int]]]]
 
 
-def _get_rings_data(geoms: Iterable[Polygon | MultiPolygon]) -> list[_RingData]:
-    rings_data: list[_RingData] = []
-    poly_id = -1
-    for geom_id, geom in enumerate(geoms):
-        for poly_id, poly in enumerate(geom.geoms if isinstance(geom, MultiPolygon) else (geom,), start=poly_id + 1):  # noqa: B020
-            for ring in (poly.exterior, *poly.interiors):
-                coords2 = get_coordinates(ring)[:-1]  # skip last point
-                coords1 = coords2[:, 0] + coords2[:, 1] * 1j
-                rings_data.append(_RingData(geom_id, poly_id, coords1))
-    return rings_data
+class Topology:
+    __slots__ = ('_coords', '_geoms_sizes', '_polys_sizes', '_rings_offsets', '_shm', '_significance')
+    _coords: NDArray[np.complexfloating]
+    _significance: NDArray[np.floating]
+    _rings_offsets: NDArray[np.integer]
+    _polys_sizes: list[int]
+    _geoms_sizes: list[int]
+    _shm: list[SharedMemory]
+
+    def __init__(
+        self,
+        geoms: Iterable[Polygon | MultiPolygon],
+        endpoints: NDArray[np.complexfloating] | None = None,
+    ):
+        # endpoints, when known upfront, must be sorted and contain all points where shared borders start or end
+        coords, rings_offsets, self._polys_sizes, self._geoms_sizes = _get_rings(geoms)
+        if endpoints is None:
+            endpoints = _find_endpoints(coords, rings_offsets)
+        coords, arcs_starts = _split_into_arcs(coords, rings_offsets, endpoints)
+        del endpoints
+        self._coords = coords
+        self._significance = _rank_arcs(coords, rings_offsets, arcs_starts)
+        self._rings_offsets = rings_offsets
+
+    def __len__(self) -> int:
+        return len(self._geoms_sizes)
+
+    def simplify(self, tolerance: float, start: int = 0, stop: int | None = None) -> list[Polygon | MultiPolygon]:
+        polys_sizes = self._polys_sizes
+        geoms_sizes = self._geoms_sizes
+        if start != 0 or stop is not None:
+            polys_start, polys_stop = _range_offsets(geoms_sizes, start, stop)
+            rings_start, rings_stop = _range_offsets(polys_sizes, polys_start, polys_stop)
+            polys_sizes = polys_sizes[polys_start:polys_stop]
+            geoms_sizes = geoms_sizes[start:stop]
+        else:
+            rings_start, rings_stop = 0, len(self._rings_offsets) - 1
 
+        rings_offsets = self._rings_offsets[rings_start : rings_stop + 1]
+        coords_start = rings_offsets[0]
+        coords_stop = rings_offsets[-1]
+        significance = self._significance[coords_start:coords_stop]
+        rings_offsets = rings_offsets - coords_start
 
-def _find_endpoints(rings_data: Iterable[_RingData]) -> NDArray[np.complexfloating]:
-    all_coords = np.hstack(tuple(c.coords for c in rings_data))
-    unique_coords, counts = np.unique(all_coords, return_counts=True)  # unique_coords are sorted
-    del all_coords
-    mask = np.zeros_like(unique_coords, dtype=np.bool_)
-
-    for ring in rings_data:
-        coords = ring.coords
-        unique_indices = np.searchsorted(unique_coords, coords)
-        ring_counts = counts[unique_indices]
-        changes = np.diff(ring_counts, append=ring_counts[0])
-        mask[unique_indices[(changes < 0) | np.roll((changes > 0), 1)]] = True
+        keep = _simplify_mask(significance, rings_offsets, tolerance)
+        rings_sizes = np.add.reduceat(keep, rings_offsets[:-1], dtype=np.int64)
+        polys = _reconstruct_polys(self._coords[coords_start:coords_stop][keep], rings_sizes, polys_sizes)
+        return _reconstruct_geoms(polys, geoms_sizes)
 
+    def simplify_arcs(self, tolerance: float) -> TopologyArcs:
+        # simplified shared arcs, each stored once, with rings oriented like shapely.geometry.polygon.orient
+        rings_offsets = self._rings_offsets
+        keep = _simplify_mask(self._significance, rings_offsets, tolerance)
+        coords = self._coords[keep]
+        arcs_starts = np.isinf(self._significance[keep])
+        rings_sizes = np.add.reduceat(keep, rings_offsets[:-1], dtype=np.int64)
+        del keep
+        rings_offsets = np.concatenate(((0,), np.cumsum(rings_sizes)))
+
+        # signed ring areas, exterior rings should be counter-clockwise and interior rings clockwise
+        next_indices = np.arange(1, len(coords) + 1)
+        next_indices[rings_offsets[1:] - 1] = rings_offsets[:-1]
+        areas = np.add.reduceat(np.imag(np.conj(coords) * coords[next_indices]), rings_offsets[:-1])
+        del next_indices
+        polys_sizes = np.asarray(self._polys_sizes, dtype=np.int64)
+        exterior = np.zeros(len(rings_sizes), dtype=np.bool_)
+        exterior[np.cumsum(polys_sizes) - polys_sizes] = True
+        del polys_sizes
+        reverse = (exterior & (areas < 0)) | (~exterior & (areas > 0))
+
+        arcs: list[NDArray[np.floating]] = []
+        arcs_index: dict[bytes, int] = {}
+        rings: list[list[int]] = []
+        for ring_start, ring_end, ring_reverse in zip(
+            rings_offsets[:-1].tolist(), rings_offsets[1:].tolist(), reverse.tolist(), strict=True
+        ):
+            ring_coords = np.append(coords[ring_start:ring_end], coords[ring_start])
+            splits = np.flatnonzero(arcs_starts[ring_start:ring_end]).tolist()
+            ring: list[int] = []
+            for arc_start, arc_end in zip(splits, (*splits[1:], ring_end - ring_start), strict=True):
+                arc = ring_coords[arc_start : arc_end + 1]
+                arc_key = arc.tobytes()
+                arc_idx = arcs_index.get(arc_key)
+                if arc_idx is None:
+                    arc_idx = arcs_index.get(arc[::-1].tobytes())
+                    if arc_idx is not None:
+                        arc_idx = ~arc_idx
+                    else:
+                        arc_idx = arcs_index[arc_key] = len(arcs)
+                        arcs.append(np.column_stack((np.real(arc), np.imag(arc))))
+                ring.append(arc_idx)
+            if ring_reverse:
+                ring = [~arc_idx for arc_idx in reversed(ring)]
+            rings.append(ring)
+
+        polys = [rings[start:end] for start, end in pairwise((0, *np.cumsum(self._polys_sizes).tolist()))]
+        geoms = [polys[start:end] for start, end in pairwise((0, *np.cumsum(self._geoms_sizes).tolist()))]
+        return TopologyArcs(arcs, geoms)
+
+    def partition(self, parts: int) -> list[tuple[int, int]]:
+        # split geometries into [start, stop) ranges of similar coords count
+        polys_ends = np.cumsum(self._polys_sizes)
+        rings_ends = polys_ends[np.cumsum(self._geoms_sizes) - 1]
+        geoms_ends = self._rings_offsets[rings_ends]
+        bounds = np.searchsorted(geoms_ends, np.linspace(0, geoms_ends[-1], parts + 1)[1:-1], side='right') + 1
+        bounds = np.unique(np.concatenate(((0,), bounds.clip(max=len(geoms_ends)), (len(geoms_ends),))))
+        return [(int(start), int(stop)) for start, stop in pairwise(bounds)]
+
+    def save(self, path: Path) -> None:
+        # write the arrays into the directory, for use with Topology.load
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / 'coords.npy', self._coords)
+        np.save(path / 'significance.npy', self._significance)
+        np.save(path / 'rings_offsets.npy', self._rings_offsets)
+        np.save(path / 'polys_sizes.npy', np.asarray(self._polys_sizes, dtype=np.int64))
+        np.save(path / 'geoms_sizes.npy', np.asarray(self._geoms_sizes, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: Path, *, mmap: bool = True) -> 'Topology':
+        # memory-mapped arrays are read lazily, and shared between processes by the page cache
+        mmap_mode = 'r' if mmap else None
+        self = cls.__new__(cls)
+        self._coords = np.load(path / 'coords.npy', mmap_mode=mmap_mode)
+        self._significance = np.load(path / 'significance.npy', mmap_mode=mmap_mode)
+        self._rings_offsets = np.load(path / 'rings_offsets.npy', mmap_mode=mmap_mode)
+        self._polys_sizes = np.load(path / 'polys_sizes.npy').tolist()
+        self._geoms_sizes = np.load(path / 'geoms_sizes.npy').tolist()
+        return self
+
+    @contextmanager
+    def share(self) -> Iterator[SharedTopology]:
+        # copy the arrays into shared memory, for use with Topology.attach in other processes
+        shms: list[SharedMemory] = []
+        try:
+            shared_arrays: list[_SharedArray] = []
+            for array in (self._coords, self._significance, self._rings_offsets):
+                shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+                shms.append(shm)
+                np.ndarray(array.shape, array.dtype, shm.buf)[:] = array
+                shared_arrays.append(_SharedArray(shm.name, array.dtype.str, array.shape))
+            coords, significance, rings_offsets = shared_arrays
+            yield SharedTopology(coords, significance, rings_offsets, self._polys_sizes, self._geoms_sizes)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    @classmethod
+    def attach(cls, shared: SharedTopology) -> 'Topology':
+        self = cls.__new__(cls)
+        self._shm = []
+        arrays: list[NDArray] = []
+        for shared_array in (shared.coords, shared.significance, shared.rings_offsets):
+            shm = SharedMemory(shared_array.name, track=False)
+            self._shm.append(shm)
+            array = np.ndarray(shared_array.shape, shared_array.dtype, shm.buf)
+            array.flags.writeable = False
+            arrays.append(array)
+        self._coords, self._significance, self._rings_offsets = arrays
+        self._polys_sizes = shared.polys_sizes
+        self._geoms_sizes = shared.geoms_sizes
+        return self
+
+
+def _range_offsets(sizes: Sequence[int], start: int, stop: int | None) -> tuple[int, int]:
+    start_offset = sum(sizes[:start])
+    stop_offset = start_offset + sum(sizes[start:stop])
+    return start_offset, stop_offset
+
+
+def _get_rings(geoms: Iterable[Polygon | MultiPolygon]) -> _Rings:
+    polys, polys_geoms = get_parts(np.fromiter(geoms, dtype=np.object_), return_index=True)
+    rings, rings_polys = get_rings(polys, return_index=True)
+    del polys
+    rings_sizes = get_num_coordinates(rings) - 1  # skip last point
+    coords2 = get_coordinates(rings)
+    del rings
+    keep = np.ones(len(coords2), dtype=np.bool_)
+    keep[np.cumsum(rings_sizes + 1) - 1] = False
+    coords = coords2.view(np.complex128)[:, 0][keep]
+    del coords2, keep
+
+    polys_sizes = np.bincount(rings_polys)
+    geoms_sizes = np.bincount(polys_geoms[polys_sizes > 0])
+    return _Rings(
+        coords,
+        np.concatenate(((0,), np.cumsum(rings_sizes, dtype=np.int64))),
+        polys_sizes[polys_sizes > 0].tolist(),
+        geoms_sizes[geoms_sizes > 0].tolist(),
+    )
+
+
+def _next_indices(rings_offsets: NDArray[np.integer]) -> NDArray[np.integer]:
+    # index of the following point within the same ring, wrapping around to the ring start
+    next_indices = np.arange(1, rings_offsets[-1] + 1)
+    next_indices[rings_offsets[1:] - 1] = rings_offsets[:-1]
+    return next_indices
+
+
+def _find_endpoints(
+    coords: NDArray[np.complexfloating], rings_offsets: NDArray[np.integer]
+) -> NDArray[np.complexfloating]:
+    unique_coords, counts = np.unique(coords, return_counts=True)  # unique_coords are sorted
+    inverse = np.searchsorted(unique_coords, coords)
+    points_counts = counts.astype(np.int32)[inverse]
+    del counts
+    next_indices = _next_indices(rings_offsets)
+    changes = points_counts[next_indices]
+    changes -= points_counts
+    del points_counts
+
+    # shared borders start where the count increases and end where it decreases
+    mask = np.zeros_like(unique_coords, dtype=np.bool_)
+    mask[inverse[changes < 0]] = True
+    mask[inverse[next_indices[changes > 0]]] = True
     return unique_coords[mask]
 
 
-def _split_into_arcs(rings_data: Iterable[_RingData], endpoints: NDArray[np.complexfloating]) -> list[_SplitRingData]:
-    result: list[_SplitRingData] = []
-    for ring in rings_data:
-        coords = ring.coords
+def _split_into_arcs(
+    coords: NDArray[np.complexfloating],
+    rings_offsets: NDArray[np.integer],
+    endpoints: NDArray[np.complexfloating],
+) -> tuple[NDArray[np.complexfloating], NDArray[np.bool_]]:
+    # rotate each ring to start at its first endpoint, returns the rotated coords and the arcs starts mask
+    if len(endpoints):
         nearby_endpoint_indices = np.searchsorted(endpoints, coords).clip(max=len(endpoints) - 1)
-        split_indices = np.flatnonzero(coords == endpoints[nearby_endpoint_indices])
-        match len(split_indices):
-            case 0:  # case: no splits
-                arcs_coords = (np.append(coords, coords[0]),)
-            case 1:  # case: single split
-                arcs_coords = (np.hstack((coords[split_indices[0] :], coords[: split_indices[0] + 1])),)
-            case _:  # case: multiple splits
-                arcs_coords = [
-                    coords[start_idx:end_idx]
-                    for start_idx, end_idx in zip(split_indices, np.roll(split_indices, -1) + 1, strict=True)
-                ]
-                arcs_coords[-1] = np.hstack((coords[split_indices[-1] :], coords[: split_indices[0] + 1]))
-        result.append(_SplitRingData(ring.geom_id, ring.poly_id, arcs_coords))
-    return result
-
-
-def _simplify_arcs(rings_data: Iterable[_SplitRingData], tolerance: float) -> list[_SplitRingData]:
-    result: list[_SplitRingData] = []
-    for ring in rings_data:
-        ring_tolerance = tolerance
-        new_arcs: list[NDArray[np.complexfloating]] = []
-        while True:
-            # repeat until enough coords remain
-            max_distance = 0
-            new_coords_len = 0
-            for arc in ring.arcs:
-                new_arc, max_distance = _douglas_peucker(arc, ring_tolerance, max_distance)
-                new_arcs.append(new_arc)
-                if new_coords_len < 3:
-                    new_coords_len += len(new_arc) - 1
-            if new_coords_len >= 3 or max_distance == 0:
-                break
-            ring_tolerance = min(ring_tolerance, max_distance)
-            new_arcs.clear()
-        result.append(_SplitRingData(ring.geom_id, ring.poly_id, new_arcs))
-    return result
-
-
-def _douglas_peucker(
-    coords: NDArray[np.complexfloating], tolerance: float, max_distance: float
-) -> tuple[NDArray[np.complexfloating], float]:
+        splits = coords == endpoints[nearby_endpoint_indices]
+        del nearby_endpoint_indices
+    else:
+        splits = np.zeros(len(coords), dtype=np.bool_)
+
+    rings_sizes = np.diff(rings_offsets)
+    rings_indices = np.repeat(np.arange(len(rings_sizes)), rings_sizes)
+    split_indices = np.flatnonzero(splits)
+    split_rings = rings_indices[split_indices]
+    first = np.flatnonzero(np.diff(split_rings, prepend=-1))
+    rotations = np.zeros(len(rings_sizes), dtype=np.int64)
+    rotations[split_rings[first]] = split_indices[first] - rings_offsets[split_rings[first]]
+    del split_indices, split_rings, first
+
+    rings_starts = rings_offsets[rings_indices]
+    indices = np.arange(len(coords)) - rings_starts + rotations[rings_indices]
+    indices %= rings_sizes[rings_indices]
+    indices += rings_starts
+    del rings_indices, rings_starts
+
+    arcs_starts = splits[indices]
+    arcs_starts[rings_offsets[:-1]] = True
+    return coords[indices], arcs_starts
+
+
+def _rank_arcs(
+    coords: NDArray[np.complexfloating], rings_offsets: NDArray[np.integer], arcs_starts: NDArray[np.bool_]
+) -> NDArray[np.floating]:
+    # pack the arcs into a single buffer, each arc ends with the first point of the next arc
+    starts = np.flatnonzero(arcs_starts)
+    lasts = np.append(starts[1:], len(coords)) - 1
+    ends = _next_indices(rings_offsets)[lasts]
+    arcs_sizes = lasts - starts + 2
+    arcs_offsets = np.concatenate(((0,), np.cumsum(arcs_sizes)))
+    indices = np.arange(arcs_offsets[-1]) - np.repeat(arcs_offsets[:-1] - starts, arcs_sizes)
+    indices[arcs_offsets[1:] - 1] = ends
+    del starts, lasts, ends, arcs_sizes
+    significance = _douglas_peucker_batch(coords[indices], arcs_offsets)
+    del indices
+
+    # skip the last point of each arc, it is the first point of the next arc
+    keep = np.ones(len(significance), dtype=np.bool_)
+    keep[arcs_offsets[1:] - 1] = False
+    return significance[keep]
+
+
+def _douglas_peucker_batch(
+    coords: NDArray[np.complexfloating],
+    arcs_offsets: NDArray[np.integer],
+    *,
+    chunk_size: int = 1 << 20,
+) -> NDArray[np.floating]:
+    # vectorized equivalent of _douglas_peucker over many arcs packed into a single buffer
+    significance = np.zeros(len(coords), dtype=np.float64)
+    significance[arcs_offsets[:-1]] = np.inf
+    significance[arcs_offsets[1:] - 1] = np.inf
+
+    # process arcs in chunks to bound the size of temporary arrays
+    chunk_start = 0
+    arcs_len = len(arcs_offsets) - 1
+    while chunk_start < arcs_len:
+        chunk_end = np.searchsorted(arcs_offsets, arcs_offsets[chunk_start] + chunk_size, side='right') - 1
+        chunk_end = max(chunk_end, chunk_start + 1)
+        starts = arcs_offsets[chunk_start:chunk_end]
+        ends = arcs_offsets[chunk_start + 1 : chunk_end + 1] - 1
+        _douglas_peucker_intervals(coords, significance, starts, ends)
+        chunk_start = chunk_end
+
+    return significance
+
+
+def _douglas_peucker_intervals(
+    coords: NDArray[np.complexfloating],
+    significance: NDArray[np.floating],
+    starts: NDArray[np.integer],
+    ends: NDArray[np.integer],
+) -> None:
+    parents = np.full(len(starts), np.inf)
+    mask = ends - starts > 1
+    starts = starts[mask]
+    ends = ends[mask]
+    parents = parents[mask]
+
+    # each round splits all pending intervals at once
+    while len(starts):
+        sizes = ends - starts - 1
+        intervals_offsets = np.cumsum(sizes) - sizes
+        intervals_indices = np.repeat(np.arange(len(sizes)), sizes)
+        indices = np.arange(len(intervals_indices)) + np.repeat(starts + 1 - intervals_offsets, sizes)
+
+        start = coords[starts]
+        end = coords[ends]
+        u = coords[indices] - start[intervals_indices]  # point vector
+        segment = end - start
+        segment_length = np.abs(segment)
+
+        # calculate perpendicular distances, or plain distances for closed intervals
+        closed = start == end
+        closed_mask = closed[intervals_indices]
+        distances = np.abs(np.imag(np.conj(segment)[intervals_indices] * u))
+        np.divide(distances, segment_length[intervals_indices], out=distances, where=~closed_mask)
+        distances[closed_mask] = np.abs(u[closed_mask])
+        del u
+
+        # first index of the maximum distance within each interval
+        max_distances = np.maximum.reduceat(distances, intervals_offsets)
+        candidates = np.where(distances == max_distances[intervals_indices], indices, len(coords))
+        del distances
+        max_indices = np.minimum.reduceat(candidates, intervals_offsets)
+        del candidates
+
+        max_significance = np.minimum(max_distances, parents)
+        significance[max_indices] = max_significance
+
+        left = max_indices - starts > 1
+        right = ends - max_indices > 1
+        starts = np.concatenate((starts[left], max_indices[right]))
+        ends = np.concatenate((max_indices[left], ends[right]))
+        parents = np.concatenate((max_significance[left], max_significance[right]))
+
+
+def _douglas_peucker(coords: NDArray[np.complexfloating]) -> NDArray[np.floating]:
+    # significance is the largest tolerance at which the point is still kept,
+    # it never exceeds the significance of the point that split its interval
     coords_len = len(coords)
+    significance = np.zeros(coords_len, dtype=np.float64)
+    significance[0] = np.inf
+    significance[-1] = np.inf
     if coords_len <= 2:
-        return coords, max_distance
-    keep = np.zeros(coords_len, dtype=np.bool_)
-    keep[0] = True
-    keep[-1] = True
-    stack: list[tuple[int | np.integer, int | np.integer]] = [(0, coords_len - 1)]
+        return significance
+    stack: list[tuple[int | np.integer, int | np.integer, float]] = [(0, coords_len - 1, np.inf)]
 
     while stack:
-        start_idx, end_idx = stack.pop()
+        start_idx, end_idx, parent_significance = stack.pop()
         start: np.complexfloating = coords[start_idx]
         end: np.complexfloating = coords[end_idx]
         u = coords[start_idx + 1 : end_idx] - start  # point vector
@@ -130,55 +422,49 @@ def _douglas_peucker(
             distances = np.abs(np.imag(np.conj(segment) * u)) / segment_length
 
         max_idx = np.argmax(distances)
-        max_distance_ = distances[max_idx]
-        if max_distance_ >= tolerance:
-            idx = start_idx + max_idx + 1
-            keep[idx] = True
-            if idx - start_idx > 1:
-                stack.append((start_idx, idx))
-            if end_idx - idx > 1:
-                stack.append((idx, end_idx))
-        else:
-            max_distance = max(max_distance, max_distance_)
-
-    return coords[keep], max_distance
-
-
-def _reconstruct_polys(rings_data: Iterable[_SplitRingData]) -> tuple[Sequence[Polygon], list[int]]:
-    rings_coords_stack: list[NDArray[np.complexfloating]] = []
-    rings_coords_sizes: list[int] = []
-    polys_sizes: list[int] = []
-    geoms_sizes: list[int] = []
-    last_poly_id = -1
-    last_geom_id = -1
-    for ring in rings_data:
-        coords = np.hstack(tuple(c[:-1] for c in ring.arcs))
-        coords_len = len(coords)
-        rings_coords_stack.append(coords)
-        rings_coords_sizes.append(coords_len)
-
-        if last_poly_id != (poly_id := ring.poly_id):
-            last_poly_id = poly_id
-            polys_sizes.append(1)
-
-            if last_geom_id != (geom_id := ring.geom_id):
-                last_geom_id = geom_id
-                geoms_sizes.append(1)
-            else:
-                geoms_sizes[-1] += 1
-        else:
-            polys_sizes[-1] += 1
-
-    rings_indices = np.repeat(np.arange(len(rings_coords_sizes), dtype=np.uint32), rings_coords_sizes)
-    del rings_coords_sizes
-    rings_coords = np.hstack(rings_coords_stack)
-    del rings_coords_stack
+        idx = start_idx + max_idx + 1
+        idx_significance = min(distances[max_idx], parent_significance)
+        significance[idx] = idx_significance
+        if idx - start_idx > 1:
+            stack.append((start_idx, idx, idx_significance))
+        if end_idx - idx > 1:
+            stack.append((idx, end_idx, idx_significance))
+
+    return significance
+
+
+def _simplify_mask(
+    significance: NDArray[np.floating], rings_offsets: NDArray[np.integer], tolerance: float
+) -> NDArray[np.bool_]:
+    keep = significance >= tolerance
+    rings_sizes = np.add.reduceat(keep, rings_offsets[:-1], dtype=np.int64)
+
+    # lower the tolerance of rings with too few coords remaining
+    for ring_idx in np.flatnonzero(rings_sizes < 3):
+        start_idx = rings_offsets[ring_idx]
+        end_idx = rings_offsets[ring_idx + 1]
+        ring_significance = significance[start_idx:end_idx]
+        if len(ring_significance) < 3:
+            continue
+        ring_tolerance = np.partition(ring_significance, -3)[-3]
+        if ring_tolerance <= 0:
+            # not enough distinct coords, keep everything that is not collinear
+            ring_tolerance = np.nextafter(0, 1)
+        keep[start_idx:end_idx] = ring_significance >= ring_tolerance
+
+    return keep
+
+
+def _reconstruct_polys(
+    rings_coords: NDArray[np.complexfloating], rings_sizes: NDArray[np.integer], polys_sizes: Sequence[int]
+) -> Sequence[Polygon]:
+    rings_indices = np.repeat(np.arange(len(rings_sizes), dtype=np.uint32), rings_sizes)
     rings_coords = np.dstack((rings_coords.real, rings_coords.imag))[0]
     rings: Sequence[LinearRing] = linearrings(rings_coords, indices=rings_indices)  # pyright: ignore[reportAssignmentType]
     del rings_coords, rings_indices
     polys_indices = np.repeat(np.arange(len(polys_sizes), dtype=np.uint32), polys_sizes)
     polys: Sequence[Polygon] = polygons(rings, indices=polys_indices)  # pyright: ignore[reportAssignmentType]
-    return polys, geoms_sizes
+    return polys
 
 
 def _reconstruct_geoms(polys: Sequence[Polygon], geoms_sizes: Sequence[int]) -> list[Polygon | MultiPolygon]:
@@ -1,20 +1,34 @@
 import asyncio
 import functools
+import os
+import shutil
 import time
 import traceback
+from collections.abc import Iterator
+from contextlib import contextmanager
 from datetime import timedelta
+from decimal import Decimal
+from ipaddress import IPv4Address, IPv6Address
+from pathlib import Path
 
 from httpx import AsyncClient, Timeout
 from httpx_secure import httpx_ssrf_protection
 
-from config import USER_AGENT
+from config import HTTP_ALLOW_LOOPBACK, USER_AGENT
+
+
+def _global_or_loopback(_hostname: str, ip: IPv4Address | IPv6Address, _port: int) -> bool:
+    return ip.is_global or ip.is_loopback
+
 
 HTTP = httpx_ssrf_protection(
     AsyncClient(
         headers={'User-Agent': USER_AGENT},
         timeout=Timeout(60, connect=15),
         follow_redirects=True,
-    )
+    ),
+    check_globally_reachable=not HTTP_ALLOW_LOOPBACK,
+    custom_validator=_global_or_loopback if HTTP_ALLOW_LOOPBACK else None,
 )
 
 
@@ -41,3 +55,40 @@ def retry_exponential(timeout: timedelta | None, *, start: float = 1):
         return wrapper
 
     return decorator
+
+
+def quality_suffix(q: float) -> str:
+    # file name suffix of a quality, e.g. 0.001 -> '0-001'
+    return f'{Decimal(str(q)):f}'.replace('.', '-')
+
+
+@contextmanager
+def atomic_path(path: Path, suffix: str = '.tmp') -> Iterator[Path]:
+    # yield a temporary file or directory path next to path, moved over it when the block succeeds
+    temp_path = path.with_name(f'{path.name}{suffix}')
+    _remove(temp_path)
+    try:
+        yield temp_path
+    except BaseException:
+        _remove(temp_path)
+        raise
+    replace_path(temp_path, path)
+
+
+def replace_path(src: Path, dst: Path) -> None:
+    # directories can't be replaced in a single step, the old one is moved aside first
+    if src.is_dir() and dst.exists():
+        old_path = dst.with_name(f'{dst.name}.old')
+        _remove(old_path)
+        os.replace(dst, old_path)  # noqa: PTH105
+        os.replace(src, dst)  # noqa: PTH105
+        _remove(old_path)
+    else:
+        os.replace(src, dst)  # noqa: PTH105
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
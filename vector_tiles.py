@@ -0,0 +1,325 @@
+import gzip
+import json
+import sqlite3
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from itertools import pairwise
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+from shapely import (
+    STRtree,
+    bounds,
+    box,
+    clip_by_rect,
+    from_wkb,
+    get_coordinates,
+    get_num_coordinates,
+    get_parts,
+    get_rings,
+    get_type_id,
+    is_empty,
+    to_wkb,
+    transform,
+)
+from shapely.geometry.base import BaseGeometry
+from tqdm import tqdm
+
+from config import GEOJSON_QUALITIES, VECTOR_TILES_MAX_ZOOM, VECTOR_TILES_WORKERS
+from osm_countries_gen import OSMCountry
+from utils import atomic_path
+
+# see https://github.com/mapbox/vector-tile-spec/tree/master/2.1 and https://github.com/mapbox/mbtiles-spec
+_LAYER_NAME = 'countries'
+_EXTENT = 4096
+_BUFFER = 64  # in tile units
+_TILE_SIZE = 256  # display size in pixels, for choosing the simplification tolerance
+_ROOT_ZOOM = 3  # tasks are subtrees rooted at this zoom
+_MAX_LATITUDE = 85.0511287798066
+_TAGS = ('ISO3166-1', 'ISO3166-1:alpha3', 'name', 'name:en')
+
+_GEOMETRY_TYPE_POLYGON = 3
+_COMMAND_MOVE_TO = 1 | (1 << 3)
+_COMMAND_LINE_TO = 2
+_COMMAND_CLOSE_PATH = 7 | (1 << 3)
+
+_worker_geoms: dict[float, NDArray[np.object_]] = {}
+_worker_trees: dict[float, STRtree] = {}
+_worker_tags: list[list[tuple[str, str]]] = []
+
+
+def zoom_quality(zoom: int) -> float:
+    # the coarsest quality whose tolerance does not exceed a display pixel
+    pixel_size = 360 / (_TILE_SIZE << zoom)
+    return max((q for q in GEOJSON_QUALITIES if q <= pixel_size), default=min(GEOJSON_QUALITIES))
+
+
+def write_mbtiles(path: Path, countries: Sequence[OSMCountry], max_zoom: int = VECTOR_TILES_MAX_ZOOM) -> None:
+    # each quality covers a contiguous range of zoom levels
+    zoom_ranges: dict[float, tuple[int, int]] = {}
+    for zoom in range(max_zoom + 1):
+        q = zoom_quality(zoom)
+        zoom_ranges[q] = (zoom_ranges.get(q, (zoom,))[0], zoom)
+
+    geoms_wkb = {
+        q: to_wkb(transform([country.geometry[q] for country in countries], _project)).tolist() for q in zoom_ranges
+    }
+    tags = [[(key, country.tags[key]) for key in _TAGS if key in country.tags] for country in countries]
+    tasks: list[tuple[float, int, int, int, int, int]] = []
+    for q, (range_min_zoom, range_max_zoom) in zoom_ranges.items():
+        root_zoom = min(range_min_zoom, _ROOT_ZOOM)
+        tasks.extend(
+            (q, range_min_zoom, range_max_zoom, root_zoom, x, y)
+            for x in range(1 << root_zoom)
+            for y in range(1 << root_zoom)
+        )
+
+    with atomic_path(path) as temp_path, closing(sqlite3.connect(temp_path)) as db:
+        db.executescript("""
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """)
+        db.executemany(
+            'INSERT INTO metadata VALUES (?, ?)',
+            (
+                ('name', path.stem),
+                ('format', 'pbf'),
+                ('type', 'overlay'),
+                ('minzoom', '0'),
+                ('maxzoom', str(max_zoom)),
+                ('bounds', f'-180,{-_MAX_LATITUDE},180,{_MAX_LATITUDE}'),
+                (
+                    'json',
+                    json.dumps({
+                        'vector_layers': [
+                            {
+                                'id': _LAYER_NAME,
+                                'fields': dict.fromkeys(_TAGS, 'String'),
+                                'minzoom': 0,
+                                'maxzoom': max_zoom,
+                            }
+                        ]
+                    }),
+                ),
+            ),
+        )
+
+        for tiles in _run_tasks(tasks, geoms_wkb, tags):
+            # MBTiles rows are numbered from the bottom
+            db.executemany(
+                'INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                ((z, x, (1 << z) - 1 - y, data) for z, x, y, data in tiles),
+            )
+        db.commit()
+
+
+def _run_tasks(
+    tasks: Sequence[tuple[float, int, int, int, int, int]],
+    geoms_wkb: dict[float, list[bytes]],
+    tags: list[list[tuple[str, str]]],
+) -> Iterable[list[tuple[int, int, int, bytes]]]:
+    if VECTOR_TILES_WORKERS <= 1:
+        _tiles_worker_init(geoms_wkb, tags)
+        return tqdm((_tiles_worker(*task) for task in tasks), desc='Generating tiles', total=len(tasks))
+
+    def parallel():
+        with ProcessPoolExecutor(
+            VECTOR_TILES_WORKERS,
+            mp_context=get_context('spawn'),
+            initializer=_tiles_worker_init,
+            initargs=(geoms_wkb, tags),
+        ) as executor:
+            results = executor.map(_tiles_worker, *zip(*tasks, strict=True))
+            yield from tqdm(results, desc='Generating tiles', total=len(tasks))
+
+    return parallel()
+
+
+def _project(coords: NDArray[np.float64]) -> NDArray[np.float64]:
+    # lon/lat to web mercator, scaled to a unit square with y pointing down
+    lon = coords[:, 0]
+    lat = np.radians(coords[:, 1].clip(-_MAX_LATITUDE, _MAX_LATITUDE))
+    x = (lon + 180) / 360
+    y = (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2
+    return np.column_stack((x, y))
+
+
+def _tiles_worker_init(geoms_wkb: dict[float, list[bytes]], tags: list[list[tuple[str, str]]]) -> None:
+    global _worker_tags
+    for q, wkbs in geoms_wkb.items():
+        _worker_geoms[q] = geoms = from_wkb(wkbs)
+        _worker_trees[q] = STRtree(geoms)
+    _worker_tags = tags
+
+
+def _tiles_worker(
+    q: float, min_zoom: int, max_zoom: int, root_zoom: int, root_x: int, root_y: int
+) -> list[tuple[int, int, int, bytes]]:
+    # clip each tile from the clipped pieces of its parent tile, depth-first
+    geoms = _worker_geoms[q]
+    root_bounds = _tile_bounds(root_zoom, root_x, root_y)
+    indices = _worker_trees[q].query(box(*root_bounds))
+    indices.sort()
+    stack = [(root_zoom, root_x, root_y, indices, geoms[indices])]
+
+    result: list[tuple[int, int, int, bytes]] = []
+    while stack:
+        zoom, x, y, indices, pieces = stack.pop()
+        min_x, min_y, max_x, max_y = _tile_bounds(zoom, x, y)
+        pieces = clip_by_rect(pieces, min_x, min_y, max_x, max_y)
+        mask = ~is_empty(pieces)
+        if not mask.any():
+            continue
+        indices = indices[mask]
+        pieces = pieces[mask]
+
+        if zoom >= min_zoom and (tile := _encode_tile(zoom, x, y, indices, pieces)):
+            result.append((zoom, x, y, gzip.compress(tile, mtime=0)))
+
+        if zoom < max_zoom:
+            pieces_bounds = bounds(pieces)
+            for child_x in (2 * x, 2 * x + 1):
+                for child_y in (2 * y, 2 * y + 1):
+                    child_min_x, child_min_y, child_max_x, child_max_y = _tile_bounds(zoom + 1, child_x, child_y)
+                    child_mask = (
+                        (pieces_bounds[:, 0] <= child_max_x)
+                        & (pieces_bounds[:, 1] <= child_max_y)
+                        & (pieces_bounds[:, 2] >= child_min_x)
+                        & (pieces_bounds[:, 3] >= child_min_y)
+                    )
+                    if child_mask.any():
+                        stack.append((zoom + 1, child_x, child_y, indices[child_mask], pieces[child_mask]))
+
+    return result
+
+
+def _tile_bounds(zoom: int, x: int, y: int) -> tuple[float, float, float, float]:
+    size = 1 / (1 << zoom)
+    buffer = size * _BUFFER / _EXTENT
+    return x * size - buffer, y * size - buffer, (x + 1) * size + buffer, (y + 1) * size + buffer
+
+
+def _encode_tile(zoom: int, x: int, y: int, indices: NDArray[np.integer], pieces: NDArray[np.object_]) -> bytes | None:
+    scale = _EXTENT << zoom
+    offset = np.array((x, y)) * _EXTENT
+
+    keys: dict[str, int] = {}
+    values: dict[str, int] = {}
+    features = bytearray()
+    for i, piece in zip(indices.tolist(), pieces, strict=True):
+        geometry = _encode_geometry(piece, scale, offset)
+        if geometry is None:
+            continue
+        feature_tags: list[int] = []
+        for key, value in _worker_tags[i]:
+            feature_tags.append(keys.setdefault(key, len(keys)))
+            feature_tags.append(values.setdefault(value, len(values)))
+        feature = (
+            _field_varint(1, i)  # country index
+            + _field_bytes(2, _varints(np.array(feature_tags, dtype=np.uint64)))
+            + _field_varint(3, _GEOMETRY_TYPE_POLYGON)
+            + _field_bytes(4, _varints(geometry))
+        )
+        features += _field_bytes(2, feature)
+
+    if not features:
+        return None
+
+    layer = bytearray()
+    layer += _field_varint(15, 2)
+    layer += _field_bytes(1, _LAYER_NAME.encode())
+    layer += features
+    for key in keys:
+        layer += _field_bytes(3, key.encode())
+    for value in values:
+        layer += _field_bytes(4, _field_bytes(1, value.encode()))
+    layer += _field_varint(5, _EXTENT)
+    return _field_bytes(3, layer)
+
+
+def _encode_geometry(geom: BaseGeometry, scale: int, offset: NDArray[np.integer]) -> NDArray[np.uint64] | None:
+    polys = get_parts(geom)
+    polys = polys[get_type_id(polys) == 3]  # clipping may also produce lines and points
+    rings, polys_indices = get_rings(polys, return_index=True)
+    coords = np.rint(get_coordinates(rings) * scale - offset).astype(np.int64)
+    rings_ends = np.cumsum(get_num_coordinates(rings)).tolist()
+    rings_bounds = tuple(pairwise((0, *rings_ends)))
+    polys_starts = np.searchsorted(polys_indices, np.arange(len(polys) + 1)).tolist()
+
+    commands: list[NDArray[np.int64]] = []
+    last_point = np.zeros(2, dtype=np.int64)
+    for poly_start, poly_end in pairwise(polys_starts):
+        for ring_idx in range(poly_start, poly_end):
+            ring_start, ring_end = rings_bounds[ring_idx]
+            points = _ring_points(coords[ring_start : ring_end - 1], exterior=ring_idx == poly_start)
+            if points is None:
+                if ring_idx == poly_start:
+                    break  # skip holes of collapsed polygons
+                continue
+
+            deltas = np.diff(points, axis=0, prepend=last_point[np.newaxis])
+            deltas = (deltas << 1) ^ (deltas >> 63)  # zigzag
+            last_point = points[-1]
+            commands.append(
+                np.concatenate((
+                    (_COMMAND_MOVE_TO,),
+                    deltas[0],
+                    (_COMMAND_LINE_TO | ((len(points) - 1) << 3),),
+                    deltas[1:].ravel(),
+                    (_COMMAND_CLOSE_PATH,),
+                ))
+            )
+
+    if not commands:
+        return None
+    return np.concatenate(commands).astype(np.uint64)
+
+
+def _ring_points(points: NDArray[np.int64], *, exterior: bool) -> NDArray[np.int64] | None:
+    # drop points that collapsed after rounding, exterior rings have a positive area in tile coordinates
+    points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+    if len(points) < 3:
+        return None
+    x = points[:, 0]
+    y = points[:, 1]
+    area = int(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+    if area == 0:
+        return None
+    return points if (area > 0) == exterior else points[::-1]
+
+
+def _varints(values: NDArray[np.uint64]) -> bytes:
+    # vectorized protobuf varint encoding
+    values = values.astype(np.uint64, copy=False)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        sizes += values >= (1 << bits)
+    offsets = np.cumsum(sizes) - sizes
+    result = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for i in range(int(sizes.max(initial=0))):
+        mask = sizes > i
+        byte = (values[mask] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        byte |= np.where(sizes[mask] > i + 1, np.uint64(0x80), np.uint64(0))
+        result[offsets[mask] + i] = byte
+    return result.tobytes()
+
+
+def _varint(value: int) -> bytes:
+    result = bytearray()
+    while value > 0x7F:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _field_varint(field: int, value: int) -> bytes:
+    return _varint(field << 3) + _varint(value)
+
+
+def _field_bytes(field: int, data: bytes | bytearray) -> bytes:
+    return _varint((field << 3) | 2) + _varint(len(data)) + data
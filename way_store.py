@@ -0,0 +1,97 @@
+from collections.abc import Iterable
+
+import numpy as np
+from numpy.typing import NDArray
+
+
+class WayStore:
+    __slots__ = ('_coords', '_index', '_offsets')
+    _coords: NDArray[np.floating]
+    _offsets: NDArray[np.integer]
+    _index: dict[int, int]
+
+    def __init__(self, ways: Iterable[dict]):
+        # store each way once, as slices of contiguous arrays
+        coords_stack: list[NDArray[np.floating]] = []
+        sizes: list[int] = [0]
+        self._index = {}
+        for way in ways:
+            if way['id'] in self._index:
+                continue
+            if len(way['nodes']) != len(way['geometry']):
+                raise ValueError(f'Way geometry does not match its nodes (way/{way["id"]})')
+            self._index[way['id']] = len(coords_stack)
+            coords_stack.append(way['geometry'])
+            sizes.append(len(way['nodes']))
+        self._coords = np.vstack(coords_stack) if coords_stack else np.empty((0, 2), dtype=np.float64)
+        self._offsets = np.cumsum(sizes)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, way_id: int) -> bool:
+        return way_id in self._index
+
+    def coords(self, way_id: int) -> NDArray[np.floating]:
+        idx = self._index[way_id]
+        return self._coords[self._offsets[idx] : self._offsets[idx + 1]]
+
+    def junctions(self, relations: Iterable[dict]) -> NDArray[np.complexfloating]:
+        # sorted coords of nodes where the border topology changes: nodes with other than 2 border edges,
+        # or nodes between edges of different relations, ways merely continuing the same border are not split;
+        # nodes are identified by their coords, like in Topology, as different nodes may share a location
+        points, nodes_inverse = np.unique(self._coords[:, 0] + self._coords[:, 1] * 1j, return_inverse=True)
+        nodes_len = len(points)
+
+        # relations using each way, as (way index, relation index) pairs
+        members: set[tuple[int, int]] = set()
+        for relation_idx, relation in enumerate(relations):
+            for member in relation.get('members', ()):
+                if member['type'] == 'way' and (way_idx := self._index.get(member['ref'])) is not None:
+                    members.add((way_idx, relation_idx))
+        members_array = np.array(sorted(members), dtype=np.int64).reshape(-1, 2)
+        way_parents_offsets = np.searchsorted(members_array[:, 0], np.arange(len(self._offsets)))
+        way_parents_counts = np.diff(way_parents_offsets)
+
+        # border edges between consecutive nodes of each way, the same edge may appear in many ways
+        ways_sizes = np.diff(self._offsets)
+        ways_indices = np.repeat(np.arange(len(ways_sizes)), ways_sizes)
+        is_edge = np.ones(len(self._coords), dtype=np.bool_)
+        is_edge[self._offsets[1:] - 1] = False
+        edge_starts = np.flatnonzero(is_edge)
+        u = nodes_inverse[edge_starts]
+        v = nodes_inverse[edge_starts + 1]
+        edge_ways = ways_indices[edge_starts]
+        del ways_indices, is_edge, edge_starts
+        proper = u != v
+        u, v, edge_ways = np.minimum(u, v)[proper], np.maximum(u, v)[proper], edge_ways[proper]
+        edges_keys, edges_inverse = np.unique(u * nodes_len + v, return_inverse=True)
+        edges_u = edges_keys // nodes_len
+        edges_v = edges_keys % nodes_len
+        del u, v, edges_keys
+        degree = np.bincount(edges_u, minlength=nodes_len) + np.bincount(edges_v, minlength=nodes_len)
+
+        # relations of each edge, as unique (edge index, relation index) pairs
+        pairs_counts = way_parents_counts[edge_ways]
+        pairs_edges = np.repeat(edges_inverse, pairs_counts)
+        pairs_offsets = np.cumsum(pairs_counts) - pairs_counts
+        pairs_members = np.arange(len(pairs_edges)) - np.repeat(
+            pairs_offsets - way_parents_offsets[edge_ways], pairs_counts
+        )
+        pairs = np.unique(np.column_stack((pairs_edges, members_array[pairs_members, 1])), axis=0)
+        del edge_ways, edges_inverse, pairs_counts, pairs_edges, pairs_offsets, pairs_members
+        edges_relations = np.bincount(pairs[:, 0], minlength=len(edges_u))
+
+        # both edges of a node have the same relations, when each has as many as the node has in total
+        nodes_pairs = np.unique(
+            np.concatenate((
+                np.column_stack((edges_u[pairs[:, 0]], pairs[:, 1])),
+                np.column_stack((edges_v[pairs[:, 0]], pairs[:, 1])),
+            )),
+            axis=0,
+        )
+        nodes_relations = np.bincount(nodes_pairs[:, 0], minlength=nodes_len)
+        edges_relations_sum = np.bincount(edges_u, edges_relations, nodes_len) + np.bincount(
+            edges_v, edges_relations, nodes_len
+        )
+        return points[(degree != 2) | (edges_relations_sum != 2 * nodes_relations)]